@@ -1,24 +1,27 @@
-import uuid
 from datetime import datetime, timezone
+import asyncio
 import json
 import os
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Response
 from sqlalchemy.orm import Session
 from .schemas import (Project, ProjectCreate, ProjectUpdate, ProjectPartialUpdate,
-                      CommentTypeUpsert, Document, DocumentCreate)
-from .database import DB_INITIALIZER
-from . import crud_projects, crud_comments, crud_documents, config
-from typing import List
+                      CommentTypeUpsert, Document, DocumentCreate, DatabaseHealth)
+from .database import DB_INITIALIZER, models
+from .database.pool import is_pool_saturated
+from . import (crud_projects, crud_comments, crud_documents, config, reconcile_storage, responses, storage,
+               upload_limit)
+from typing import List, Tuple
 
 cfg: config.Config = config.load_config()
-SessionLocal = DB_INITIALIZER.init_database(str(cfg.postgres_dsn))
+blob_storage = storage.BlobStorage(cfg.storage_path, cfg.upload_chunk_size, cfg.max_upload_size)
 
 app = FastAPI()
+app.add_middleware(upload_limit.UploadSizeLimitMiddleware, max_size=cfg.max_upload_size)
 
 
 def get_db():
-    db = SessionLocal()
+    db = DB_INITIALIZER.session_maker()
     try:
         yield db
     finally:
@@ -31,6 +34,7 @@ extensions = {
     "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
     "application/x-zip-compressed": ".zip"
 }
+media_types = {extension: media_type for media_type, extension in extensions.items()}
 
 
 @app.post("/projects", response_model=Project, summary='Добавляет проект в базу')
@@ -41,12 +45,13 @@ def add_project(project: ProjectCreate,
     for file in files:
         extension = extensions.get(file.content_type)
         if extension:
-            file_path = create_file_path(storage_path=cfg.storage_path, extension=extension)
-            create_file(file=file, file_path=file_path)
+            file_path, size, sha256 = create_file(db=db, file=file, extension=extension)
             crud_documents.create_document(
                 db=db,
                 file_name=file.filename,
                 file_path=file_path,
+                size=size,
+                sha256=sha256,
                 user_id=project.creator_id,
                 project_id=project.id
             )
@@ -61,54 +66,59 @@ def get_projects_list(db: Session = Depends(get_db)) -> List[Project]:
 @app.get("/projects/{project_id}",
          response_model=Project,
          summary='Возвращает информацию о проекте')
-def get_project_info(project_id: int, db: Session = Depends(get_db)) -> Project:
+def get_project_info(project_id: int, response: Response, db: Session = Depends(get_db)) -> Project:
     project = crud_projects.get_project(db=db, project_id=project_id)
     if project is None:
         raise HTTPException(status_code=404, detail="Проект не найден")
+    response.headers["etag"] = responses.version_etag(project.version)
     return project
 
 
 @app.put("/projects/{project_id}",
          response_model=Project,
          summary='Обновляет информацию о проекте')
-def update_project(project_id: int, project: ProjectUpdate, db: Session = Depends(get_db)) -> Project:
+def update_project(project_id: int,
+                   project: ProjectUpdate,
+                   request: Request,
+                   response: Response,
+                   db: Session = Depends(get_db)) -> Project:
     create_date = datetime.now(timezone.utc)
-    update_dict, updated_project = crud_projects.update_project(
-        db=db, project_id=project_id, create_date=create_date, project=project
-    )
+    try:
+        _, updated_project = crud_projects.update_project(
+            db=db, project_id=project_id, create_date=create_date, project=project,
+            if_match=responses.parse_if_match(request)
+        )
+    except crud_projects.VersionConflict as e:
+        raise version_conflict(e.version)
+    except crud_projects.UpdateConflict:
+        raise HTTPException(status_code=409, detail="Проект непрерывно изменяется другими запросами, повторите запрос")
     if updated_project is None:
         raise HTTPException(status_code=404, detail="Проект не найден")
-    for field, value in update_dict.items():
-        crud_comments.create_system_comment(
-            db=db,
-            user_id=project.user_id,
-            create_date=create_date,
-            field=field,
-            value=value,
-            project_id=project_id
-        )
+    response.headers["etag"] = responses.version_etag(updated_project.version)
     return updated_project
 
 
 @app.patch("/projects/{project_id}",
            response_model=Project,
            summary='Обновляет отделные поля проекта')
-def partial_update_project(project_id: int, project: ProjectPartialUpdate, db: Session = Depends(get_db)) -> Project:
+def partial_update_project(project_id: int,
+                           project: ProjectPartialUpdate,
+                           request: Request,
+                           response: Response,
+                           db: Session = Depends(get_db)) -> Project:
     create_date = datetime.now(timezone.utc)
-    update_dict, updated_project = crud_projects.partial_update_project(
-        db=db, project_id=project_id, create_date=create_date, project=project
-    )
+    try:
+        _, updated_project = crud_projects.partial_update_project(
+            db=db, project_id=project_id, create_date=create_date, project=project,
+            if_match=responses.parse_if_match(request)
+        )
+    except crud_projects.VersionConflict as e:
+        raise version_conflict(e.version)
+    except crud_projects.UpdateConflict:
+        raise HTTPException(status_code=409, detail="Проект непрерывно изменяется другими запросами, повторите запрос")
     if updated_project is None:
         raise HTTPException(status_code=404, detail="Проект не найден")
-    for field, value in update_dict.items():
-        crud_comments.create_system_comment(
-            db=db,
-            user_id=project.user_id,
-            create_date=create_date,
-            field=field,
-            value=value,
-            project_id=project_id
-        )
+    response.headers["etag"] = responses.version_etag(updated_project.version)
     return updated_project
 
 
@@ -118,12 +128,12 @@ def delete_project(project_id: int, db: Session = Depends(get_db)) -> Project:
     if deleted_project is None:
         raise HTTPException(status_code=404, detail="Проект не найден")
     for file_path in file_paths:
-        os.remove(file_path)
+        storage.remove_file(file_path)
     return deleted_project
 
 
 @app.post("/documents",
-          response_model=list(Document),
+          response_model=list[Document],
           summary='Добавляет вложения в базу')
 def add_documents(document: DocumentCreate,
                   files: List[UploadFile] = File(None),
@@ -134,12 +144,13 @@ def add_documents(document: DocumentCreate,
     for file in files:
         extension = extensions.get(file.content_type)
         if extension:
-            file_path = create_file_path(storage_path=cfg.storage_path, extension=extension)
-            create_file(file=file, file_path=file_path)
+            file_path, size, sha256 = create_file(db=db, file=file, extension=extension)
             document = crud_documents.create_document(
                 db=db,
                 file_name=file.filename,
                 file_path=file_path,
+                size=size,
+                sha256=sha256,
                 user_id=document.user_id,
                 project_id=document.project_id
             )
@@ -148,37 +159,105 @@ def add_documents(document: DocumentCreate,
 
 
 @app.get("/documents",
-         response_model=list(Document),
+         response_model=list[Document],
          summary='Возвращает список вложений')
 def get_documents_list(project_id: int, db: Session = Depends(get_db)) -> List[Document]:
     return crud_documents.get_documents(db=db, project_id=project_id)
 
 
+@app.get("/documents/{document_id}/content",
+         response_class=Response,
+         summary='Возвращает содержимое вложения, поддерживает докачку через Range')
+def get_document_content(document_id: int, request: Request, db: Session = Depends(get_db)) -> Response:
+    document = crud_documents.get_document(db=db, document_id=document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Документ не найден")
+    if not os.path.isfile(document.file_path):
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    return responses.file_response(
+        request=request,
+        path=document.file_path,
+        etag=document_etag(document),
+        last_modified=document.create_date,
+        media_type=media_types.get(os.path.splitext(document.file_path)[1], "application/octet-stream"),
+        filename=document.name
+    )
+
+
 @app.delete("/documents/{document_id}",
             response_model=Document,
             summary='Удаляет вложение из базы')
 def delete_document(document_id: int, db: Session = Depends(get_db)) -> Document:
-    deleted_document = crud_documents.delete_document(db=db, document_id=document_id)
+    deleted_document, file_paths = crud_documents.delete_document(db=db, document_id=document_id)
     if deleted_document is None:
         raise HTTPException(status_code=404, detail="Документ не найден")
-    os.remove(deleted_document.file_path)
+    for file_path in file_paths:
+        storage.remove_file(file_path)
     return deleted_document
 
 
-def create_file_path(storage_path: str, extension: str):
-    return os.path.join(storage_path, str(uuid.uuid4()) + extension)
+def version_conflict(version: int) -> HTTPException:
+    return HTTPException(
+        status_code=412,
+        detail="Проект был изменен, получите его текущую версию",
+        headers={"etag": responses.version_etag(version)}
+    )
+
+
+def document_etag(document: models.ProjectDocument) -> str:
+    if document.sha256:
+        return f'"{document.sha256}"'
+    return f'"{document.id}-{int(document.create_date.timestamp())}"'
 
 
-def create_file(file: UploadFile, file_path: str):
+def create_file(db: Session, file: UploadFile, extension: str) -> Tuple[str, int, str]:
+    if file.size is not None and file.size > cfg.max_upload_size:
+        raise HTTPException(status_code=413, detail="Размер файла превышает допустимый")
     try:
-        with open(file_path, "wb") as out_file:
-            out_file.write(file.file.read())
+        pending = blob_storage.write_temp(file.file)
+    except storage.UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Размер файла превышает допустимый")
     except Exception:
         raise HTTPException(status_code=500, detail="Ошибка при работе с файлом")
+    file_path = crud_documents.acquire_blob(
+        db=db,
+        sha256=pending.sha256,
+        size=pending.size,
+        file_path=blob_storage.blob_path(pending.sha256, extension)
+    )
+    try:
+        blob_storage.store(pending, file_path)
+    except Exception:
+        blob_storage.discard(pending)
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Ошибка при работе с файлом")
+    return file_path, pending.size, pending.sha256
+
+
+@app.get("/health/db",
+         response_model=DatabaseHealth,
+         summary='Возвращает состояние пула соединений с БД')
+def get_db_health(response: Response) -> DatabaseHealth:
+    pool = DB_INITIALIZER.pool_stats()
+    status = "ok"
+    if is_pool_saturated(pool):
+        status = "saturated"
+        response.status_code = 503
+    return {"status": status, "pool": pool}
 
 
 @app.on_event("startup")
 async def on_startup():
+    DB_INITIALIZER.init_database(
+        str(cfg.postgres_dsn),
+        pool_size=cfg.db_pool_size,
+        max_overflow=cfg.db_max_overflow,
+        pool_timeout=cfg.db_pool_timeout,
+        pool_recycle=cfg.db_pool_recycle,
+        pool_pre_ping=cfg.db_pool_pre_ping,
+        statement_timeout=cfg.db_statement_timeout
+    )
+
     comment_types = []
     with open(cfg.default_project_comment_types_config_path, encoding="utf-8") as f:
         comment_types = json.load(f)
@@ -188,3 +267,15 @@ async def on_startup():
             crud_comments.upsert_comment_type(
                 db, CommentTypeUpsert(**comment_type)
             )
+
+    app.state.reconcile_task = None
+    if cfg.storage_reconcile_interval > 0:
+        app.state.reconcile_task = asyncio.create_task(
+            reconcile_storage.run_periodically(cfg.storage_reconcile_interval)
+        )
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if app.state.reconcile_task is not None:
+        app.state.reconcile_task.cancel()
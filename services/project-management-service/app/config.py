@@ -10,6 +10,42 @@ class Config(BaseSettings):
         alias='POSTGRES_DSN'
     )
 
+    db_pool_size: int = Field(
+        default=5,
+        env='DB_POOL_SIZE',
+        alias='DB_POOL_SIZE'
+    )
+
+    db_max_overflow: int = Field(
+        default=10,
+        env='DB_MAX_OVERFLOW',
+        alias='DB_MAX_OVERFLOW'
+    )
+
+    db_pool_timeout: float = Field(
+        default=30,
+        env='DB_POOL_TIMEOUT',
+        alias='DB_POOL_TIMEOUT'
+    )
+
+    db_pool_recycle: int = Field(
+        default=-1,
+        env='DB_POOL_RECYCLE',
+        alias='DB_POOL_RECYCLE'
+    )
+
+    db_pool_pre_ping: bool = Field(
+        default=False,
+        env='DB_POOL_PRE_PING',
+        alias='DB_POOL_PRE_PING'
+    )
+
+    db_statement_timeout: int = Field(
+        default=0,
+        env='DB_STATEMENT_TIMEOUT',
+        alias='DB_STATEMENT_TIMEOUT'
+    )
+
     default_project_comment_types_config_path: FilePath = Field(
         default='default-project-comment-types.json',
         env='DEFAULT_PROJECT_COMMENT_TYPES_CONFIG_PATH',
@@ -22,6 +58,24 @@ class Config(BaseSettings):
         alias='STORAGE_PATH'
     )
 
+    max_upload_size: int = Field(
+        default=256 * 1024 * 1024,
+        env='MAX_UPLOAD_SIZE',
+        alias='MAX_UPLOAD_SIZE'
+    )
+
+    upload_chunk_size: int = Field(
+        default=1024 * 1024,
+        env='UPLOAD_CHUNK_SIZE',
+        alias='UPLOAD_CHUNK_SIZE'
+    )
+
+    storage_reconcile_interval: float = Field(
+        default=0,
+        env='STORAGE_RECONCILE_INTERVAL',
+        alias='STORAGE_RECONCILE_INTERVAL'
+    )
+
     model_config = SettingsConfigDict(env_file=".env")
 
     @classmethod
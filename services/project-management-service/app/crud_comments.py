@@ -36,14 +36,13 @@ def get_comment_type(db: Session,
     return result.scalars().one_or_none()
 
 
-def create_system_comment(db: Session,
-                          project_id: int,
-                          user_id: uuid.UUID,
-                          create_date: datetime,
-                          field: str,
-                          value: Any) -> models.ProjectComment:
+def build_system_comment(project_id: int,
+                         user_id: uuid.UUID,
+                         create_date: datetime,
+                         field: str,
+                         value: Any) -> dict:
     """
-    Создает новый системный комментарий в БД
+    Формирует значения системного комментария об изменении поля проекта
     """
     data = {}
     type_id = 1
@@ -65,15 +64,29 @@ def create_system_comment(db: Session,
             data["early_completion_date"] = str(value[0])
             data["completion_date"] = str(value[1])
 
-    db_comment = models.ProjectComment(
-        user_id=user_id,
-        data=data,
-        create_date=create_date,
-        type_id=type_id,
-        project_id=project_id
-    )
+    return {
+        "id": uuid.uuid4(),
+        "user_id": user_id,
+        "data": data,
+        "create_date": create_date,
+        "type_id": type_id,
+        "project_id": project_id
+    }
 
-    db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return db_comment
+
+def create_system_comments(db: Session,
+                           project_id: int,
+                           user_id: uuid.UUID,
+                           create_date: datetime,
+                           update_dict: dict) -> None:
+    """
+    Добавляет системные комментарии обо всех измененных полях одним INSERT,
+    фиксация транзакции остается за вызывающей стороной
+    """
+    if not update_dict:
+        return
+
+    db.execute(insert(models.ProjectComment).values([
+        build_system_comment(project_id, user_id, create_date, field, value)
+        for field, value in update_dict.items()
+    ]))
@@ -1,15 +1,21 @@
 import uuid
+from collections import Counter
 from datetime import datetime, timezone
-from typing import List
+from typing import List, Tuple
 
+from sqlalchemy import case, delete, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from .database import models
+from . import storage
 
 
 def create_document(db: Session,
                     file_name: str,
                     file_path: str,
+                    size: int,
+                    sha256: str,
                     user_id: uuid.UUID,
                     project_id: int) -> models.ProjectDocument:
     """
@@ -19,6 +25,8 @@ def create_document(db: Session,
         user_id=user_id,
         name=file_name,
         file_path=file_path,
+        size=size,
+        sha256=sha256,
         create_date=datetime.now(timezone.utc),
         project_id=project_id
     )
@@ -51,17 +59,98 @@ def get_document(db: Session,
 
 
 def delete_document(db: Session,
-                    document_id: int) -> models.ProjectDocument | None:
+                    document_id: int) -> tuple[models.ProjectDocument, List[str]] | tuple[None, None]:
     """
-    Удаляет вложение
+    Удаляет вложение. Счетчик ссылок блоба уменьшается по строке из DELETE ... RETURNING, поэтому
+    при параллельном удалении того же вложения его уменьшает только удаливший запрос
     """
-    deleted_document = get_document(db, document_id)
-    result = (db.query(models.ProjectDocument)
-              .filter(models.ProjectDocument.id == document_id)
-              .delete())
+    deleted_document = db.execute(
+        delete(models.ProjectDocument)
+        .where(models.ProjectDocument.id == document_id)
+        .returning(models.ProjectDocument)
+        .execution_options(synchronize_session=False)
+    ).scalars().one_or_none()
+    if deleted_document is None:
+        db.rollback()
+        return None, None
+
+    file_paths, blobs = release_blobs(db, [(deleted_document.file_path, deleted_document.sha256)])
 
     db.commit()
+    delete_unreferenced_blobs(db, blobs)
+    return deleted_document, file_paths
+
+
+def acquire_blob(db: Session,
+                 sha256: str,
+                 size: int,
+                 file_path: str) -> str:
+    """
+    Учитывает новую ссылку на блоб (создает его запись при первой ссылке) и возвращает путь к файлу блоба.
+    Транзакция не фиксируется
+    """
+    stm = insert(models.ProjectDocumentBlob).values(
+        sha256=sha256,
+        file_path=file_path,
+        size=size,
+        ref_count=1,
+        create_date=datetime.now(timezone.utc)
+    )
+    stm = stm.on_conflict_do_update(
+        index_elements=[models.ProjectDocumentBlob.sha256],
+        set_={"ref_count": models.ProjectDocumentBlob.ref_count + 1}
+    ).returning(models.ProjectDocumentBlob.file_path)
+    return db.execute(stm).scalar_one()
+
 
-    if result == 1:
-        return deleted_document
-    return None
+def delete_documents(db: Session, *criteria) -> Tuple[List[str], List[str]]:
+    """
+    Удаляет вложения по условиям criteria одним DELETE ... RETURNING и уменьшает счетчики ссылок блобов
+    только у действительно удаленных строк. Возвращает пути файлов вложений, сохраненных вне хранилища
+    блобов, и хэши затронутых блобов. Транзакция не фиксируется
+    """
+    rows = db.execute(
+        delete(models.ProjectDocument)
+        .where(*criteria)
+        .returning(models.ProjectDocument.file_path, models.ProjectDocument.sha256)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return release_blobs(db, rows)
+
+
+def release_blobs(db: Session, rows: List[Tuple[str, str | None]]) -> Tuple[List[str], List[str]]:
+    """
+    Уменьшает счетчики ссылок блобов по строкам (file_path, sha256) удаляемых вложений.
+    Транзакция не фиксируется
+    """
+    file_paths = [file_path for file_path, sha256 in rows if not storage.is_blob_path(file_path, sha256)]
+    released = Counter(sha256 for file_path, sha256 in rows if storage.is_blob_path(file_path, sha256))
+    if released:
+        db.execute(
+            update(models.ProjectDocumentBlob)
+            .where(models.ProjectDocumentBlob.sha256.in_(released))
+            .values(ref_count=models.ProjectDocumentBlob.ref_count
+                    - case(released, value=models.ProjectDocumentBlob.sha256))
+            .execution_options(synchronize_session=False)
+        )
+    return file_paths, list(released)
+
+
+def delete_unreferenced_blobs(db: Session,
+                              blobs: List[str]) -> List[str]:
+    """
+    Удаляет блобы, на которые не осталось ссылок, вместе с их файлами. Файлы удаляются до фиксации
+    транзакции, пока строки блобов заблокированы, поэтому параллельная загрузка того же содержимого
+    дождется удаления и запишет файл заново
+    """
+    if not blobs:
+        return []
+    file_paths = db.execute(
+        delete(models.ProjectDocumentBlob)
+        .where(models.ProjectDocumentBlob.sha256.in_(blobs), models.ProjectDocumentBlob.ref_count <= 0)
+        .returning(models.ProjectDocumentBlob.file_path)
+    ).scalars().all()
+    for file_path in file_paths:
+        storage.remove_file(file_path)
+    db.commit()
+    return file_paths
@@ -1,8 +1,45 @@
+import uuid
 from datetime import datetime, timezone
 from typing import List, Tuple
+from sqlalchemy import or_, update
 from sqlalchemy.orm import Session
 from .database import models
-from . import schemas
+from . import schemas, crud_comments, crud_documents
+
+# Поля проекта, которые меняют PUT и PATCH
+project_update_fields = ("name", "description", "completion_date")
+
+# Сколько раз обновление повторяется, если проект параллельно изменяют другие запросы
+MAX_UPDATE_ATTEMPTS = 5
+
+
+class VersionConflict(Exception):
+    """
+    Версия проекта не совпала с переданной в If-Match
+    """
+
+    def __init__(self, version: int) -> None:
+        super().__init__(version)
+        self.version = version
+
+
+class UpdateConflict(Exception):
+    """
+    Проект не удалось обновить за MAX_UPDATE_ATTEMPTS попыток: его непрерывно изменяют другие запросы
+    """
+
+
+def normalize_update_values(values: dict) -> dict:
+    """
+    Приводит даты к UTC, чтобы сравнение с прочитанными из БД значениями (с часовым поясом)
+    совпадало со сравнением в БД. Даты без часового пояса считаются датами в UTC
+    """
+    normalized = {}
+    for field, value in values.items():
+        if isinstance(value, datetime):
+            value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+        normalized[field] = value
+    return normalized
 
 
 def create_project(db: Session,
@@ -46,77 +83,108 @@ def get_project(db: Session,
 def update_project(db: Session,
                    project_id: int,
                    create_date: datetime,
-                   project: schemas.ProjectUpdate) -> Tuple[dict | None, models.Project | None]:
+                   project: schemas.ProjectUpdate,
+                   if_match: List[int] | None = None) -> Tuple[dict | None, models.Project | None]:
     """
     Обновляет информацию о проекте
     """
-    current_project = get_project(db, project_id)
-    update_dict = {}
-
-    if not current_project:
-        return update_dict, None
-
-    for field, value in project.model_dump(exclude={"user_id"}).items():
-        current_value = getattr(current_project, field)
-        if current_value != value:
-            update_dict[field] = current_value, value
-
-    result = (db.query(models.Project)
-              .filter(models.Project.id == project_id)
-              .update(project.model_dump(exclude={"user_id"}) | {"update_date": create_date}))
-
-    db.commit()
-
-    if result == 1:
-        return update_dict, get_project(db, project_id)
-    return None, None
+    return apply_project_update(
+        db, project_id, create_date, project.user_id, project.model_dump(exclude={"user_id"}), if_match
+    )
 
 
 def partial_update_project(db: Session,
                            project_id: int,
                            create_date: datetime,
-                           project: schemas.ProjectPartialUpdate) -> Tuple[dict | None, models.Project | None]:
+                           project: schemas.ProjectPartialUpdate,
+                           if_match: List[int] | None = None) -> Tuple[dict | None, models.Project | None]:
     """
     Обновляет частично информацию о проекте
     """
-    current_project = get_project(db, project_id)
-    update_dict = {}
-
-    if not current_project:
-        return update_dict, None
+    return apply_project_update(
+        db, project_id, create_date, project.user_id, project.model_dump(exclude_unset=True, exclude={"user_id"}),
+        if_match
+    )
 
-    for field, value in project.model_dump(exclude_unset=True, exclude={"user_id"}).items():
-        current_value = getattr(current_project, field)
-        if current_value != value:
-            update_dict[field] = current_value, value
 
-    result = (db.query(models.Project)
-              .filter(models.Project.id == project_id)
-              .update(project.model_dump(exclude_unset=True, exclude={"user_id"}) | {"update_date": create_date}))
+def apply_project_update(db: Session,
+                         project_id: int,
+                         create_date: datetime,
+                         user_id: uuid.UUID,
+                         values: dict,
+                         if_match: List[int] | None = None) -> Tuple[dict | None, models.Project | None]:
+    """
+    Записывает изменения одним UPDATE ... FROM без блокировок: соединение таблицы с самой собой
+    возвращает в RETURNING прежние значения для системных комментариев, а условие на version
+    отбрасывает обновление, если проект успели изменить. Если передан if_match, версия проекта должна
+    быть одной из указанных, иначе выбрасывается VersionConflict. Без if_match обновление
+    параллельно измененного проекта повторяется с его новыми значениями, но не более MAX_UPDATE_ATTEMPTS раз,
+    затем выбрасывается UpdateConflict. Если значения не изменились, UPDATE не изменяет строку
+    """
+    values = normalize_update_values(values)
+    old = models.Project.__table__.alias("old")
+    criteria = [
+        models.Project.id == project_id, old.c.id == models.Project.id, models.Project.version == old.c.version
+    ]
+    if if_match is not None:
+        criteria.append(models.Project.version.in_(if_match))
+    changed = [getattr(models.Project, field).is_distinct_from(value) for field, value in values.items()]
+
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        row = None
+        if changed:
+            row = db.execute(
+                update(models.Project)
+                .where(*criteria, or_(*changed))
+                .values(values | {"update_date": create_date, "version": models.Project.version + 1})
+                .returning(models.Project, *(old.c[field].label(f"old_{field}") for field in project_update_fields))
+                .execution_options(populate_existing=True, synchronize_session=False)
+            ).one_or_none()
+        if row is not None:
+            break
+
+        # Строка не обновлена: проекта нет, версия не совпала или значения не изменились
+        db.rollback()
+        current_project = get_project(db, project_id)
+        if current_project is None:
+            return {}, None
+        if if_match is not None and current_project.version not in if_match:
+            raise VersionConflict(current_project.version)
+        if all(getattr(current_project, field) == value for field, value in values.items()):
+            return {}, current_project
+    else:
+        raise UpdateConflict()
+
+    current_project, *old_values = row
+    old_values = dict(zip(project_update_fields, old_values))
+    update_dict = {
+        field: (old_values[field], value) for field, value in values.items() if old_values[field] != value
+    }
+    crud_comments.create_system_comments(
+        db=db, project_id=project_id, user_id=user_id, create_date=create_date, update_dict=update_dict
+    )
 
     db.commit()
-
-    if result == 1:
-        return update_dict, get_project(db, project_id)
-    return None, None
+    return update_dict, current_project
 
 
 def delete_project(db: Session, project_id: int) -> tuple[models.Project, List[str]] | tuple[None, None]:
     """
-    Удаляет информацию о проекте
+    Удаляет информацию о проекте. Вложения проекта удаляются до него самого, чтобы счетчики ссылок
+    блобов уменьшались по строкам, удаленным этим запросом, а не каскадно
     """
     deleted_project = get_project(db, project_id)
-    file_paths = []
-    if deleted_project:
-        for document in deleted_project.documents:
-            file_paths.append(document.file_path)
+    if deleted_project is None:
+        return None, None
+    file_paths, blobs = crud_documents.delete_documents(db, models.ProjectDocument.project_id == project_id)
 
     result = (db.query(models.Project)
               .filter(models.Project.id == project_id)
               .delete())
+    if result != 1:
+        db.rollback()
+        return None, None
 
     db.commit()
-
-    if result == 1:
-        return deleted_project, file_paths
-    return None, None
+    crud_documents.delete_unreferenced_blobs(db, blobs)
+    return deleted_project, file_paths
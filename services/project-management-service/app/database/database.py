@@ -1,16 +1,62 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
+from .pool import MeteredQueuePool
+
 
 class DatabaseInitializer:
     def __init__(self, base) -> None:
         self.base = base
+        self.engine = None
+        self.session_maker = None
+
+    def init_database(self,
+                      postgres_dsn,
+                      pool_size: int = 5,
+                      max_overflow: int = 10,
+                      pool_timeout: float = 30,
+                      pool_recycle: int = -1,
+                      pool_pre_ping: bool = False,
+                      statement_timeout: int = 0):
+        connect_args = {}
+        if statement_timeout:
+            connect_args["options"] = f"-c statement_timeout={statement_timeout}"
+        self.engine = create_engine(
+            postgres_dsn,
+            poolclass=MeteredQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping,
+            connect_args=connect_args
+        )
+        self.session_maker = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=self.engine)
+        # Новые таблицы создаются вместе с индексами; индексы существующих таблиц
+        # строит команда python -m app.migrate_schema
+        self.base.metadata.create_all(bind=self.engine)
+        with self.engine.begin() as conn:
+            self.add_missing_columns(conn)
+        return self.session_maker
+
+    def add_missing_columns(self, conn):
+        """
+        Добавляет в существующие таблицы объявленные в моделях столбцы, которых в них еще нет.
+        create_all создает только новые таблицы, а схема пополняется столбцами, допускающими NULL
+        или имеющими значение по умолчанию
+        """
+        inspector = inspect(conn)
+        for table in self.base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not (column.nullable or column.server_default is not None):
+                    continue
+                column_spec = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN IF NOT EXISTS {column_spec}'))
 
-    def init_database(self, postgres_dsn):
-        engine = create_engine(postgres_dsn)
-        session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        self.base.metadata.create_all(bind=engine)
-        return session_local
+    def pool_stats(self) -> dict:
+        return self.engine.pool.stats()
 
 
 class Base(DeclarativeBase):
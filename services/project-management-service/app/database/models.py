@@ -1,6 +1,6 @@
 import uuid
 
-from sqlalchemy import Column, Integer, String, Text, UUID, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, UUID, DateTime, ForeignKey, Index, text
 from sqlalchemy.orm import mapped_column, relationship
 from sqlalchemy.dialects.postgresql import JSONB
 from .database import Base
@@ -8,6 +8,9 @@ from .database import Base
 
 class Project(Base):
     __tablename__ = "projects"
+    __table_args__ = (
+        Index("ix_projects_create_date", "create_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
@@ -16,12 +19,16 @@ class Project(Base):
     create_date = Column(DateTime(timezone=True))
     update_date = Column(DateTime(timezone=True))
     completion_date = Column(DateTime(timezone=True))
+    version = Column(Integer, nullable=False, server_default=text("1"))
     comments = relationship("ProjectComment", backref='project')
     documents = relationship("ProjectDocument", backref='project')
 
 
 class ProjectComment(Base):
     __tablename__ = "project_comment"
+    __table_args__ = (
+        Index("ix_project_comment_project_id_create_date", "project_id", "create_date"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     user_id = Column(UUID(as_uuid=True), nullable=False)
@@ -40,9 +47,23 @@ class ProjectCommentType(Base):
 
 class ProjectDocument(Base):
     __tablename__ = "project_document"
+    __table_args__ = (
+        Index("ix_project_document_project_id_create_date", "project_id", "create_date"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(UUID(as_uuid=True), nullable=False)
     name = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
+    size = Column(BigInteger)
+    sha256 = Column(String(64))
     create_date = Column(DateTime(timezone=True))
     project_id = mapped_column(ForeignKey("projects.id", ondelete='CASCADE'), nullable=False)
+
+
+class ProjectDocumentBlob(Base):
+    __tablename__ = "project_document_blob"
+    sha256 = Column(String(64), primary_key=True)
+    file_path = Column(String, nullable=False, unique=True)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False)
+    create_date = Column(DateTime(timezone=True))
@@ -0,0 +1,46 @@
+"""
+Строит индексы, объявленные в моделях, которых еще нет в существующих таблицах. При старте сервис
+только создает новые таблицы и добавляет столбцы, поэтому после обновления команду нужно выполнить
+до запуска или во время работы сервиса.
+
+Запуск: python -m app.migrate_schema
+
+Индексы строятся через CREATE INDEX CONCURRENTLY, не блокируя запись; индекс, оставшийся невалидным
+после прерванного построения, удаляется и строится заново, поэтому команду можно просто запустить повторно
+"""
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from .database import DB_INITIALIZER
+from . import config
+
+
+def create_indexes() -> None:
+    engine = DB_INITIALIZER.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        existing = dict(conn.execute(text(
+            "SELECT c.relname, i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = current_schema()"
+        )).all())
+        for table in DB_INITIALIZER.base.metadata.sorted_tables:
+            for index in table.indexes:
+                if existing.get(index.name):
+                    continue
+                index.dialect_options["postgresql"]["concurrently"] = True
+                if index.name in existing:
+                    print(f"Удаление невалидного индекса {index.name}")
+                    conn.execute(DropIndex(index))
+                print(f"Построение индекса {index.name}")
+                conn.execute(CreateIndex(index))
+
+
+def main():
+    cfg = config.load_config()
+    DB_INITIALIZER.init_database(str(cfg.postgres_dsn))
+    create_indexes()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Переносит вложения, сохраненные плоско в корне хранилища, в шардированную структуру каталогов
+storage/ab/cd/<имя> и обновляет file_path в project_document и project_document_blob пакетами.
+
+Запуск: python -m app.migrate_storage [--batch-size 1000]
+
+Каждый пакет фиксируется отдельно, файл переносится до обновления строки, а строки с уже
+перенесенным файлом только обновляются, поэтому прерванную миграцию можно просто запустить повторно
+"""
+import argparse
+import os
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from .database import DB_INITIALIZER, models
+from . import config, storage
+
+
+def migrate_file(root: str, file_path: str) -> str | None:
+    """
+    Переносит файл в шардированный каталог и возвращает его новый путь,
+    или None, если файл уже перенесен в прошлый раз или не найден
+    """
+    if os.path.dirname(os.path.relpath(file_path, root)):
+        return None
+    target_path = storage.sharded_path(root, os.path.basename(file_path))
+    if os.path.exists(file_path):
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(file_path, target_path)
+    elif not os.path.exists(target_path):
+        print(f"Файл не найден: {file_path}")
+        return None
+    return target_path
+
+
+def migrate_table(db: Session, root: str, model, batch_size: int) -> int:
+    """
+    Обходит таблицу по первичному ключу пакетами и переносит файлы ее строк
+    """
+    key = model.__mapper__.primary_key[0]
+    last_key = None
+    migrated = 0
+    while True:
+        query = select(key, model.file_path).order_by(key).limit(batch_size)
+        if last_key is not None:
+            query = query.where(key > last_key)
+        rows = db.execute(query).all()
+        if not rows:
+            return migrated
+
+        changes = []
+        for row_key, file_path in rows:
+            target_path = migrate_file(root, file_path)
+            if target_path is not None:
+                changes.append({key.key: row_key, "file_path": target_path})
+        if changes:
+            db.execute(update(model), changes)
+        db.commit()
+
+        migrated += len(changes)
+        last_key = rows[-1][0]
+        print(f"{model.__tablename__}: перенесено {migrated}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос вложений в шардированную структуру каталогов")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    cfg = config.load_config()
+    SessionLocal = DB_INITIALIZER.init_database(str(cfg.postgres_dsn))
+    with SessionLocal() as db:
+        for model in (models.ProjectDocumentBlob, models.ProjectDocument):
+            migrate_table(db, cfg.storage_path, model, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Сверяет файлы хранилища вложений с БД и убирает файлы-сироты, на которые не ссылается
+ни project_document, ни project_document_blob: файлы, оставшиеся после сбоя при удалении или загрузке,
+и брошенные временные файлы загрузок. Также удаляет блобы, на которые не осталось ссылок.
+
+Запуск: python -m app.reconcile_storage [--delete | --dry-run] [--min-age 3600] [--batch-size 1000]
+
+По умолчанию файлы-сироты переносятся в каталог <storage_path>/.quarantine с сохранением
+относительного пути, с --delete удаляются, с --dry-run только учитываются в отчете. Место,
+занятое файлами в карантине, освобождается только после очистки каталога, поэтому в отчете
+они учитываются отдельно от удаленных.
+Отсортированный обход каталога сравнивается слиянием с потоком путей из БД, упорядоченных
+побайтово (COLLATE "C"), поэтому в памяти держится только список найденных сирот. Пути с обеих
+сторон приводятся к путям относительно корня хранилища, так что написание storage_path
+(storage/, ./storage, абсолютный путь) не влияет на сравнение; файлы с точкой в начале имени
+в корне хранилища (например, .gitkeep) не считаются сиротами. Сироты обрабатываются только после
+сверки и только если она выглядит достоверной: если в БД есть пути, но ни один файл не сопоставлен,
+или пути из БД после приведения идут не по порядку, сверка прерывается без изменений.
+Файлы моложе --min-age секунд пропускаются: файл загрузки записывается до фиксации строки документа
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+from typing import Iterator, Tuple
+
+from sqlalchemy import func, select, union
+from sqlalchemy.orm import Session
+
+from .database import DB_INITIALIZER, models
+from . import config, crud_documents, storage
+
+QUARANTINE_DIR = ".quarantine"
+
+
+class ReconcileAborted(Exception):
+    """
+    Сверка недостоверна (например, storage_path не совпадает с путями в БД), сироты не обработаны
+    """
+
+
+def sweep_blobs(db: Session, report: Counter, dry_run: bool) -> None:
+    """
+    Удаляет блобы без ссылок, оставшиеся после сбоя между освобождением ссылки и удалением блоба
+    """
+    blobs = db.execute(
+        select(models.ProjectDocumentBlob.sha256).where(models.ProjectDocumentBlob.ref_count <= 0)
+    ).scalars().all()
+    db.commit()
+    if not dry_run:
+        blobs = crud_documents.delete_unreferenced_blobs(db, blobs)
+    report["unreferenced_blobs"] += len(blobs)
+
+
+def referenced_paths(db: Session, batch_size: int) -> Iterator[str]:
+    """
+    Возвращает пути файлов, на которые ссылается БД, упорядоченные побайтово, читая их пакетами
+    """
+    paths = union(
+        select(models.ProjectDocument.file_path),
+        select(models.ProjectDocumentBlob.file_path)
+    ).subquery()
+    result = db.execute(
+        select(paths.c.file_path)
+        .order_by(paths.c.file_path.collate("C"))
+        .execution_options(yield_per=batch_size)
+    )
+    yield from result.scalars()
+
+
+def relative_path(root: str, file_path: str) -> str:
+    """
+    Возвращает путь файла относительно абсолютного пути корня хранилища root
+    """
+    return os.path.relpath(os.path.abspath(file_path), root)
+
+
+def handle_orphan(root: str, file_path: str, min_age: float, action: str, report: Counter) -> None:
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return
+    if time.time() - stat.st_mtime < min_age:
+        report["recent_skipped"] += 1
+        return
+    report["orphans"] += 1
+    report["orphan_bytes"] += stat.st_size
+    if action == "delete":
+        storage.remove_file(file_path)
+        report["deleted_bytes"] += stat.st_size
+    elif action == "quarantine":
+        target_path = os.path.join(root, QUARANTINE_DIR, os.path.relpath(file_path, root))
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(file_path, target_path)
+        report["quarantined_bytes"] += stat.st_size
+
+
+def stored_files(root: str) -> Iterator[Tuple[str, str]]:
+    """
+    Возвращает пары (относительный путь, путь) файлов хранилища в порядке относительных путей,
+    пропуская карантин и файлы с точкой в начале имени в корне хранилища
+    """
+    for file_path in storage.walk_sorted(root, [os.path.join(root, QUARANTINE_DIR)]):
+        relative = os.path.relpath(file_path, root)
+        if os.sep not in relative and relative.startswith("."):
+            continue
+        yield relative, file_path
+
+
+def reconcile(db: Session, root: str, min_age: float, action: str, batch_size: int) -> Counter | None:
+    """
+    Сверяет хранилище с БД и возвращает отчет, или None, если сверку уже выполняет другой процесс.
+    Если сверка недостоверна, выбрасывает ReconcileAborted, не обработав ни одной сироты
+    """
+    root = os.path.abspath(root)
+    report = Counter()
+    sweep_blobs(db, report, dry_run=action == "report")
+
+    # Блокировка держится до конца транзакции, в которой читаются пути
+    locked = db.execute(
+        select(func.pg_try_advisory_xact_lock(func.hashtext("reconcile_storage")))
+    ).scalar_one()
+    if not locked:
+        db.rollback()
+        return None
+
+    orphans = []
+    files = stored_files(root)
+    current = next(files, None)
+    previous = None
+    try:
+        for referenced_path in referenced_paths(db, batch_size):
+            referenced = relative_path(root, referenced_path)
+            if referenced.startswith(os.pardir + os.sep):
+                report["outside_root"] += 1
+                continue
+            if previous is not None and referenced <= previous:
+                if referenced == previous:
+                    continue
+                raise ReconcileAborted(f"пути в БД после приведения к корню идут не по порядку: {referenced_path}")
+            previous = referenced
+            while current is not None and current[0] < referenced:
+                orphans.append(current[1])
+                current = next(files, None)
+            if current is not None and current[0] == referenced:
+                report["referenced"] += 1
+                current = next(files, None)
+            else:
+                report["missing"] += 1
+                print(f"Файл не найден: {referenced_path}")
+    finally:
+        db.rollback()
+    while current is not None:
+        orphans.append(current[1])
+        current = next(files, None)
+
+    if not report["referenced"] and (report["missing"] or report["outside_root"]):
+        raise ReconcileAborted(f"ни один путь из БД не найден в хранилище {root}")
+    for file_path in orphans:
+        handle_orphan(root, file_path, min_age, action, report)
+    return report
+
+
+async def run_periodically(interval: float) -> None:
+    """
+    Периодически запускает сверку отдельным процессом, чтобы обход хранилища не останавливал
+    цикл событий сервиса. Из нескольких одновременно запущенных сверок выполняется одна
+    """
+    while True:
+        await asyncio.sleep(interval)
+        process = await asyncio.create_subprocess_exec(sys.executable, "-m", __name__)
+        await process.wait()
+
+
+def run(action: str, min_age: float, batch_size: int) -> None:
+    cfg = config.load_config()
+    SessionLocal = DB_INITIALIZER.init_database(str(cfg.postgres_dsn))
+    with SessionLocal() as db:
+        try:
+            report = reconcile(db, cfg.storage_path, min_age, action, batch_size)
+        except ReconcileAborted as e:
+            print(f"Сверка прервана без изменений: {e}")
+            return
+    if report is None:
+        print("Сверка хранилища уже выполняется другим процессом")
+        return
+    print(f"Файлов со ссылками: {report['referenced']}, строк без файла: {report['missing']}, "
+          f"строк с путем вне хранилища: {report['outside_root']}")
+    print(f"Файлов-сирот: {report['orphans']} ({report['orphan_bytes']} байт), "
+          f"пропущено недавних: {report['recent_skipped']}")
+    print(f"Блобов без ссылок: {report['unreferenced_blobs']}")
+    print(f"Удалено байт: {report['deleted_bytes']}, перенесено в карантин байт: {report['quarantined_bytes']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка хранилища вложений с БД")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--delete", action="store_const", dest="action", const="delete",
+                       help="удалять файлы-сироты вместо переноса в карантин")
+    group.add_argument("--dry-run", action="store_const", dest="action", const="report",
+                       help="только вывести отчет")
+    parser.add_argument("--min-age", type=float, default=3600)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.set_defaults(action="quarantine")
+    args = parser.parse_args()
+
+    run(args.action, args.min_age, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
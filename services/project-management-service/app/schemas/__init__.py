@@ -1,7 +1,9 @@
 from .project import ProjectBase, Project, ProjectCreate, ProjectUpdate, ProjectPartialUpdate
 from .comment import Comment, CommentTypeUpsert
 from .document import DocumentBase, Document, DocumentCreate
+from .health import PoolStatus, DatabaseHealth
 
 __all__ = [ProjectBase, Project, ProjectCreate, ProjectUpdate, ProjectPartialUpdate,
            Comment, CommentTypeUpsert,
-           DocumentBase, Document, DocumentCreate]
+           DocumentBase, Document, DocumentCreate,
+           PoolStatus, DatabaseHealth]
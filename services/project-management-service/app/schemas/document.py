@@ -7,7 +7,7 @@ from pydantic import BaseModel, model_validator
 
 
 class DocumentBase(BaseModel):
-    task_id: int
+    project_id: int
     user_id: uuid.UUID
 
     class ConfigDict:
@@ -18,6 +18,8 @@ class Document(DocumentBase):
     id: int
     name: str
     file_path: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
     create_date: datetime
 
 
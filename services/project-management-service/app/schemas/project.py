@@ -25,6 +25,7 @@ class Project(ProjectBase):
     creator_id: uuid.UUID
     create_date: datetime
     update_date: Optional[datetime] = None
+    version: int
     name: str
 
 
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import uuid
+from typing import BinaryIO, Iterator, List, NamedTuple
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class PendingBlob(NamedTuple):
+    temp_path: str
+    size: int
+    sha256: str
+
+
+class BlobStorage:
+    """
+    Контентно-адресуемое хранилище вложений: содержимое хранится в одном файле на хэш SHA-256,
+    а количество ссылающихся на него документов учитывается в БД
+    """
+
+    def __init__(self, root: str, chunk_size: int, max_size: int) -> None:
+        self.root = root
+        self.temp_root = os.path.join(root, ".tmp")
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        os.makedirs(self.temp_root, exist_ok=True)
+
+    def blob_path(self, sha256: str, extension: str) -> str:
+        return sharded_path(self.root, sha256 + extension)
+
+    def write_temp(self, file: BinaryIO) -> PendingBlob:
+        """
+        Потоково записывает содержимое во временный файл, вычисляя размер и SHA-256.
+        Если размер превышает допустимый, удаляет временный файл и выбрасывает UploadTooLarge
+        """
+        temp_path = os.path.join(self.temp_root, str(uuid.uuid4()))
+        size = 0
+        sha256 = hashlib.sha256()
+        try:
+            with open(temp_path, "wb") as out_file:
+                while chunk := file.read(self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise UploadTooLarge()
+                    sha256.update(chunk)
+                    out_file.write(chunk)
+        except BaseException:
+            remove_file(temp_path)
+            raise
+        return PendingBlob(temp_path, size, sha256.hexdigest())
+
+    def store(self, pending: PendingBlob, file_path: str) -> None:
+        """
+        Атомарно помещает временный файл по пути блоба. Вызывается после учета ссылки в БД
+        и до фиксации транзакции, поэтому одновременное удаление последней ссылки не может
+        удалить только что записанный файл
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(pending.temp_path, file_path)
+
+    def discard(self, pending: PendingBlob) -> None:
+        remove_file(pending.temp_path)
+
+
+def sharded_path(root: str, file_name: str) -> str:
+    """
+    Возвращает путь вида root/ab/cd/abcd..., чтобы в одном каталоге не скапливались миллионы файлов
+    """
+    return os.path.join(root, file_name[0:2], file_name[2:4], file_name)
+
+
+def is_blob_path(file_path: str, sha256: str | None) -> bool:
+    """
+    Проверяет, что файл вложения является блобом хранилища, а не отдельным файлом,
+    сохраненным до появления хранилища блобов
+    """
+    return bool(sha256) and os.path.basename(file_path).startswith(sha256)
+
+
+def remove_file(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def walk_sorted(root: str, exclude: List[str]) -> Iterator[str]:
+    """
+    Рекурсивно обходит каталог и возвращает пути файлов в порядке сравнения строк путей целиком,
+    то есть в том же порядке, что ORDER BY file_path COLLATE "C" в БД. Каталоги из exclude пропускаются
+    """
+    with os.scandir(root) as entries:
+        # Содержимое каталога сравнивается по имени с "/" на конце, как его пути
+        entries = sorted(entries, key=lambda entry: entry.name + "/" if entry.is_dir(follow_symlinks=False)
+                         else entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if entry.path not in exclude:
+                yield from walk_sorted(entry.path, exclude)
+        elif entry.is_file(follow_symlinks=False):
+            yield entry.path
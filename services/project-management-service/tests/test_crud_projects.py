@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta, timezone
+
+from app import crud_projects
+
+
+def test_normalize_update_values_makes_dates_comparable_with_stored_values():
+    stored = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    values = crud_projects.normalize_update_values({
+        "completion_date": datetime(2024, 1, 1),
+        "name": "name"
+    })
+    assert values == {"completion_date": stored, "name": "name"}
+    assert values["completion_date"].tzinfo is timezone.utc
+
+    offset = datetime(2024, 1, 1, 3, tzinfo=timezone(timedelta(hours=3)))
+    assert crud_projects.normalize_update_values({"completion_date": offset})["completion_date"] == stored
@@ -0,0 +1,22 @@
+import pytest
+
+from app.database.pool import is_pool_saturated
+
+
+def pool_stats(checked_out: int, size: int = 5, max_overflow: int = 10) -> dict:
+    return {"size": size, "checked_out": checked_out, "max_overflow": max_overflow}
+
+
+@pytest.mark.parametrize("checked_out, saturated", [(0, False), (14, False), (15, True)])
+def test_pool_is_saturated_when_all_connections_are_checked_out(checked_out, saturated):
+    assert is_pool_saturated(pool_stats(checked_out)) is saturated
+
+
+@pytest.mark.parametrize("checked_out", [0, 5, 1000])
+def test_pool_with_unlimited_overflow_is_never_saturated(checked_out):
+    assert not is_pool_saturated(pool_stats(checked_out, max_overflow=-1))
+
+
+def test_pool_without_overflow_is_saturated_at_pool_size():
+    assert not is_pool_saturated(pool_stats(4, max_overflow=0))
+    assert is_pool_saturated(pool_stats(5, max_overflow=0))
@@ -1,29 +1,41 @@
+import asyncio
 import os
 import uuid
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
-from .schemas import (Task, TaskCreate, TaskUpdate, TaskPartialUpdate,
+from fastapi import (FastAPI, BackgroundTasks, Depends, HTTPException, UploadFile, File, Query, Request, Response,
+                     WebSocket, WebSocketDisconnect)
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .schemas import (Task, TaskCreate, TaskBatchItem, TaskBatchResult, TaskBatchGet, TaskBatchGetResult,
+                      TaskUpdate, TaskPartialUpdate, TaskPage, TaskTree,
                       Comment, UserCommentCreate, UserCommentUpdate, CommentTypeUpsert,
-                      Document, DocumentCreate)
-from .database import DB_INITIALIZER
-from . import crud_tasks, crud_comments, crud_documents, config
-from typing import List
+                      Document, DocumentCreate, DatabaseHealth, SearchPage, ProjectStats)
+from .database import DB_INITIALIZER, models
+from .database.pool import is_pool_saturated
+from . import (crud_tasks, crud_comments, crud_documents, crud_export, crud_search, crud_stats, config, events,
+               export, idempotency, pagination, reconcile_storage, responses, storage, upload_limit)
+from typing import AsyncGenerator, AsyncIterator, List, Tuple
 from datetime import datetime, timezone
 import json
 
 cfg: config.Config = config.load_config()
-SessionLocal = DB_INITIALIZER.init_database(str(cfg.postgres_dsn))
+storage.file_io.configure(cfg.file_io_workers)
+blob_storage = storage.BlobStorage(cfg.storage_path, cfg.upload_chunk_size, cfg.max_upload_size)
 
 app = FastAPI()
+app.add_middleware(
+    idempotency.IdempotencyMiddleware,
+    paths={"/tasks", "/tasks/batch", "/comments", "/documents"},
+    wait_timeout=cfg.idempotency_wait_timeout
+)
+app.add_middleware(upload_limit.UploadSizeLimitMiddleware, max_size=cfg.max_upload_size)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with DB_INITIALIZER.async_session_maker() as db:
         yield db
-    finally:
-        db.close()
 
 
 extensions = {
@@ -32,119 +44,222 @@ extensions = {
     "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
     "application/x-zip-compressed": ".zip"
 }
+media_types = {extension: media_type for media_type, extension in extensions.items()}
+task_batch_adapter = TypeAdapter(List[TaskBatchItem])
 
 
 @app.post("/tasks",
           response_model=Task,
           summary='Добавляет задачу/подзадачу проекта в базу')
-def add_task(task: TaskCreate,
-             files: List[UploadFile] = File(None),
-             db: Session = Depends(get_db)) -> Task:
-    task = crud_tasks.create_task(db=db, task=task)
+async def add_task(task: TaskCreate,
+                   files: List[UploadFile] = File(None),
+                   db: AsyncSession = Depends(get_db)) -> Task:
+    task = await crud_tasks.create_task(db=db, task=task)
     for file in files:
         extension = extensions.get(file.content_type)
         if extension:
-            file_path = create_file_path(storage_path=cfg.storage_path, extension=extension)
-            create_file(file=file, file_path=file_path)
-            crud_documents.create_document(
+            file_path, size, sha256 = await create_file(db=db, file=file, extension=extension)
+            await crud_documents.create_document(
                 db=db,
                 file_name=file.filename,
                 file_path=file_path,
+                size=size,
+                sha256=sha256,
                 user_id=task.creator_id,
                 task_id=task.id
             )
     return task
 
 
+@app.post("/tasks/batch",
+          response_model=TaskBatchResult,
+          summary='Добавляет пакет задач/подзадач проекта в базу (JSON-массив или NDJSON)')
+async def add_tasks_batch(request: Request, db: AsyncSession = Depends(get_db)) -> TaskBatchResult:
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        body = b"[" + b",".join(line for line in body.splitlines() if line.strip()) + b"]"
+    try:
+        tasks = task_batch_adapter.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    try:
+        ids = await crud_tasks.create_tasks(db=db, tasks=tasks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ids": ids}
+
+
+@app.post("/tasks/batch-get",
+          response_model=TaskBatchGetResult,
+          summary='Возвращает задачи по списку идентификаторов в порядке запроса и список ненайденных')
+async def get_tasks_batch(batch: TaskBatchGet, db: AsyncSession = Depends(get_db)) -> TaskBatchGetResult:
+    ids = list(dict.fromkeys(batch.ids))
+    tasks = {task["id"]: task for task in await crud_tasks.get_tasks_by_ids(db=db, ids=ids)}
+    return responses.FastJSONResponse({
+        "items": [dict(tasks[task_id]) for task_id in ids if task_id in tasks],
+        "missing": [task_id for task_id in ids if task_id not in tasks]
+    })
+
+
 @app.get("/tasks",
-         response_model=list[Task],
-         summary='Возвращает список задач проекта или подзадач задачи')
-def get_tasks_list(project_id: int, parent_task_id: int = None, db: Session = Depends(get_db)) -> List[Task]:
-    return crud_tasks.get_tasks(db=db, project_id=project_id, parent_task_id=parent_task_id)
+         response_model=TaskPage,
+         summary='Возвращает страницу списка задач проекта или подзадач задачи')
+async def get_tasks_list(project_id: int,
+                         request: Request,
+                         parent_task_id: int = None,
+                         limit: int = Query(default=100, ge=1, le=1000),
+                         cursor: str = None,
+                         db: AsyncSession = Depends(get_db)) -> TaskPage:
+    after = None
+    if cursor:
+        try:
+            after = pagination.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    version = await crud_tasks.get_tasks_version(db=db, project_id=project_id, parent_task_id=parent_task_id)
+    etag = responses.collection_etag(*version)
+    if responses.is_not_modified(request, etag, None):
+        return Response(status_code=304, headers={"etag": etag})
+    tasks = await crud_tasks.get_tasks(
+        db=db, project_id=project_id, parent_task_id=parent_task_id, limit=limit + 1, after=after
+    )
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = pagination.encode_cursor(tasks[-1]["create_date"], tasks[-1]["id"])
+    return responses.FastJSONResponse(
+        {"items": [dict(task) for task in tasks], "next_cursor": next_cursor},
+        headers={"etag": etag}
+    )
+
+
+@app.get("/tasks/assigned",
+         response_model=TaskPage,
+         summary='Возвращает страницу задач исполнителя по всем проектам, упорядоченных по сроку')
+async def get_assigned_tasks_list(executor_id: uuid.UUID,
+                                  due_before: datetime = None,
+                                  limit: int = Query(default=100, ge=1, le=1000),
+                                  cursor: str = None,
+                                  db: AsyncSession = Depends(get_db)) -> TaskPage:
+    after = None
+    if cursor:
+        try:
+            after = pagination.decode_cursor(cursor, nullable_date=True)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    tasks = await crud_tasks.get_assigned_tasks(
+        db=db, executor_id=executor_id, due_before=due_before, limit=limit + 1, after=after
+    )
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = pagination.encode_cursor(tasks[-1]["completion_date"], tasks[-1]["id"])
+    return responses.FastJSONResponse({"items": [dict(task) for task in tasks], "next_cursor": next_cursor})
 
 
 @app.get("/tasks/{task_id}",
          response_model=Task,
          summary='Возвращает информацию о задаче/подзадаче')
-def get_task_info(task_id: int, db: Session = Depends(get_db)) -> Task:
-    task = crud_tasks.get_task(db=db, task_id=task_id)
+async def get_task_info(task_id: int, response: Response, db: AsyncSession = Depends(get_db)) -> Task:
+    task = await crud_tasks.get_task(db=db, task_id=task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
+    response.headers["etag"] = responses.version_etag(task.version)
     return task
 
 
+@app.get("/tasks/{task_id}/tree",
+         response_model=TaskTree,
+         summary='Возвращает задачу/подзадачу вместе со всем деревом подзадач')
+async def get_task_tree(task_id: int,
+                        max_depth: int = Query(default=None, ge=0),
+                        db: AsyncSession = Depends(get_db)) -> TaskTree:
+    tasks = await crud_tasks.get_task_tree(db=db, task_id=task_id, max_depth=max_depth)
+    if not tasks:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return build_task_tree(tasks)
+
+
 @app.put("/tasks/{task_id}",
          response_model=Task,
          summary='Обновляет информацию о задаче/подзадаче')
-def update_task(task_id: int, task: TaskUpdate, db: Session = Depends(get_db)) -> Task:
+async def update_task(task_id: int,
+                      task: TaskUpdate,
+                      request: Request,
+                      response: Response,
+                      db: AsyncSession = Depends(get_db)) -> Task:
     create_date = datetime.now(timezone.utc)
-    update_dict, updated_task = crud_tasks.update_task(db=db, task_id=task_id, create_date=create_date, task=task)
+    try:
+        _, updated_task = await crud_tasks.update_task(
+            db=db, task_id=task_id, create_date=create_date, task=task, if_match=responses.parse_if_match(request)
+        )
+    except crud_tasks.VersionConflict as e:
+        raise version_conflict(e.version)
+    except crud_tasks.UpdateConflict:
+        raise HTTPException(status_code=409, detail="Задача непрерывно изменяется другими запросами, повторите запрос")
     if updated_task is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
-    for field, value in update_dict.items():
-        crud_comments.create_system_comment(
-            db=db,
-            user_id=task.user_id,
-            create_date=create_date,
-            field=field,
-            value=value,
-            task_id=task_id
-        )
+    response.headers["etag"] = responses.version_etag(updated_task.version)
     return updated_task
 
 
 @app.patch("/tasks/{task_id}",
            response_model=Task,
            summary='Обновляет отделные поля задачи/подзадачи')
-def partial_update_task(task_id: int, task: TaskPartialUpdate, db: Session = Depends(get_db)) -> Task:
+async def partial_update_task(task_id: int,
+                              task: TaskPartialUpdate,
+                              request: Request,
+                              response: Response,
+                              db: AsyncSession = Depends(get_db)) -> Task:
     create_date = datetime.now(timezone.utc)
-    update_dict, updated_task = crud_tasks.partial_update_task(
-        db=db, task_id=task_id, create_date=create_date, task=task
-    )
+    try:
+        _, updated_task = await crud_tasks.partial_update_task(
+            db=db, task_id=task_id, create_date=create_date, task=task, if_match=responses.parse_if_match(request)
+        )
+    except crud_tasks.VersionConflict as e:
+        raise version_conflict(e.version)
+    except crud_tasks.UpdateConflict:
+        raise HTTPException(status_code=409, detail="Задача непрерывно изменяется другими запросами, повторите запрос")
     if updated_task is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
-    for field, value in update_dict.items():
-        crud_comments.create_system_comment(
-            db=db,
-            user_id=task.user_id,
-            create_date=create_date,
-            field=field,
-            value=value,
-            task_id=task_id
-        )
+    response.headers["etag"] = responses.version_etag(updated_task.version)
     return updated_task
 
 
 @app.delete("/tasks/{task_id}",
             response_model=Task,
-            summary='Удаляет задачу/подзадачу из базы')
-def delete_task(task_id: int, db: Session = Depends(get_db)) -> Task:
-    deleted_task, file_paths = crud_tasks.delete_task(db=db, task_id=task_id)
+            summary='Удаляет задачу/подзадачу из базы вместе со всеми ее подзадачами')
+async def delete_task(task_id: int,
+                      background_tasks: BackgroundTasks,
+                      db: AsyncSession = Depends(get_db)) -> Task:
+    deleted_task, file_paths, blobs = await crud_tasks.delete_task(db=db, task_id=task_id)
     if deleted_task is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
-    for file_path in file_paths:
-        os.remove(file_path)
-    return deleted_task
+    # Файлы и блобы удаляются после отправки ответа, чтобы удаление большого дерева не задерживало его
+    if file_paths or blobs:
+        background_tasks.add_task(remove_deleted_files, file_paths, blobs)
+    return responses.FastJSONResponse(dict(deleted_task))
 
 
 @app.post("/comments",
           response_model=Comment,
           summary='Добавляет пользовательский комментарий к задаче/подзадаче в базу')
-def add_user_comment(comment: UserCommentCreate,
-                     files: List[UploadFile] = File(None),
-                     db: Session = Depends(get_db)) -> Comment:
-    if crud_tasks.get_task(db=db, task_id=comment.task_id) is None:
+async def add_user_comment(comment: UserCommentCreate,
+                           files: List[UploadFile] = File(None),
+                           db: AsyncSession = Depends(get_db)) -> Comment:
+    if await crud_tasks.get_task(db=db, task_id=comment.task_id) is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
-    comment = crud_comments.create_user_comment(db=db, comment=comment)
+    comment = await crud_comments.create_user_comment(db=db, comment=comment)
     for file in files:
         extension = extensions.get(file.content_type)
         if extension:
-            file_path = create_file_path(storage_path=cfg.storage_path, extension=extension)
-            create_file(file=file, file_path=file_path)
-            crud_documents.create_document(
+            file_path, size, sha256 = await create_file(db=db, file=file, extension=extension)
+            await crud_documents.create_document(
                 db=db,
                 file_name=file.filename,
                 file_path=file_path,
+                size=size,
+                sha256=sha256,
                 user_id=comment.user_id,
                 task_id=comment.task_id,
                 comment_id=comment.id
@@ -155,15 +270,24 @@ def add_user_comment(comment: UserCommentCreate,
 @app.get("/comments",
          response_model=list[Comment],
          summary='Возвращает список комментариев задачи/подзадачи')
-def get_comments_list(task_id: int, db: Session = Depends(get_db)) -> List[Comment]:
-    return crud_comments.get_comments(db=db, task_id=task_id)
+async def get_comments_list(task_id: int,
+                            request: Request,
+                            db: AsyncSession = Depends(get_db)) -> List[Comment]:
+    version = await crud_comments.get_comments_version(db=db, task_id=task_id)
+    etag = responses.collection_etag(*version)
+    if responses.is_not_modified(request, etag, None):
+        return Response(status_code=304, headers={"etag": etag})
+    comments = await crud_comments.get_comments(db=db, task_id=task_id)
+    return responses.FastJSONResponse([dict(comment) for comment in comments], headers={"etag": etag})
 
 
 @app.put("/comments/{comment_id}",
          response_model=Comment,
          summary='Обновляет пользовательский комментарий')
-def update_user_comment(comment_id: uuid.UUID, comment: UserCommentUpdate, db: Session = Depends(get_db)) -> Comment:
-    comment = crud_comments.update_user_comment(db=db, comment_id=comment_id, comment=comment)
+async def update_user_comment(comment_id: uuid.UUID,
+                              comment: UserCommentUpdate,
+                              db: AsyncSession = Depends(get_db)) -> Comment:
+    comment = await crud_comments.update_user_comment(db=db, comment_id=comment_id, comment=comment)
     if comment is None:
         raise HTTPException(status_code=404, detail="Комментарий не найден")
     return comment
@@ -172,83 +296,348 @@ def update_user_comment(comment_id: uuid.UUID, comment: UserCommentUpdate, db: S
 @app.delete("/comments/{comment_id}",
             response_model=Comment,
             summary='Удаляет пользовательский комментарий из базы')
-def delete_user_comment(comment_id: uuid.UUID, db: Session = Depends(get_db)) -> Comment:
-    deleted_comment, file_paths = crud_comments.delete_comment(db=db, comment_id=comment_id)
+async def delete_user_comment(comment_id: uuid.UUID, db: AsyncSession = Depends(get_db)) -> Comment:
+    deleted_comment, file_paths = await crud_comments.delete_comment(db=db, comment_id=comment_id)
     if deleted_comment is None:
         raise HTTPException(status_code=404, detail="Комментарий не найден")
     for file_path in file_paths:
-        os.remove(file_path)
+        await storage.file_io.run(storage.remove_file, file_path)
     return deleted_comment
 
 
 @app.post("/documents",
           response_model=list[Document],
           summary='Добавляет вложения к задаче/комментарию в базу')
-def add_documents(document: DocumentCreate,
-                  files: List[UploadFile] = File(None),
-                  db: Session = Depends(get_db)) -> List[Document]:
-    if crud_tasks.get_task(db=db, task_id=document.task_id) is None:
+async def add_documents(document: DocumentCreate,
+                        files: List[UploadFile] = File(None),
+                        db: AsyncSession = Depends(get_db)) -> List[Document]:
+    if await crud_tasks.get_task(db=db, task_id=document.task_id) is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
     if document.comment_id:
-        if crud_comments.get_task_comment(db=db, task_id=document.task_id, comment_id=document.comment_id) is None:
+        comment = await crud_comments.get_task_comment(db=db, task_id=document.task_id, comment_id=document.comment_id)
+        if comment is None:
             raise HTTPException(status_code=404, detail="Комментарий не найден")
 
     for file in files:
         extension = extensions.get(file.content_type)
         if extension:
-            file_path = create_file_path(storage_path=cfg.storage_path, extension=extension)
-            create_file(file=file, file_path=file_path)
-            document = crud_documents.create_document(
+            file_path, size, sha256 = await create_file(db=db, file=file, extension=extension)
+            document = await crud_documents.create_document(
                 db=db,
                 file_name=file.filename,
                 file_path=file_path,
+                size=size,
+                sha256=sha256,
                 user_id=document.user_id,
                 task_id=document.task_id,
                 comment_id=document.comment_id
             )
-    return get_documents_list(document.task_id, document.comment_id, db=db)
+    documents = await crud_documents.get_documents(db=db, task_id=document.task_id, comment_id=document.comment_id)
+    return responses.FastJSONResponse([dict(document) for document in documents])
 
 
 @app.get("/documents",
          response_model=list[Document],
          summary='Возвращает список вложений задачи/комментария')
-def get_documents_list(task_id: int,
-                       comment_id: uuid.UUID = None,
-                       db: Session = Depends(get_db)) -> List[Document]:
-    return crud_documents.get_documents(db=db, task_id=task_id, comment_id=comment_id)
+async def get_documents_list(task_id: int,
+                             request: Request,
+                             comment_id: uuid.UUID = None,
+                             db: AsyncSession = Depends(get_db)) -> List[Document]:
+    version = await crud_documents.get_documents_version(db=db, task_id=task_id, comment_id=comment_id)
+    etag = responses.collection_etag(*version)
+    if responses.is_not_modified(request, etag, None):
+        return Response(status_code=304, headers={"etag": etag})
+    documents = await crud_documents.get_documents(db=db, task_id=task_id, comment_id=comment_id)
+    return responses.FastJSONResponse([dict(document) for document in documents], headers={"etag": etag})
+
+
+@app.get("/documents/{document_id}/content",
+         response_class=Response,
+         summary='Возвращает содержимое вложения, поддерживает докачку через Range')
+async def get_document_content(document_id: int, request: Request, db: AsyncSession = Depends(get_db)) -> Response:
+    document = await crud_documents.get_document(db=db, document_id=document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Документ не найден")
+    if not await storage.file_io.run(os.path.isfile, document.file_path):
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    return await storage.file_io.run(
+        responses.file_response,
+        request=request,
+        path=document.file_path,
+        etag=document_etag(document),
+        last_modified=document.create_date,
+        media_type=media_types.get(os.path.splitext(document.file_path)[1], "application/octet-stream"),
+        filename=document.name
+    )
 
 
 @app.delete("/documents/{document_id}",
             response_model=Document,
             summary='Удаляет вложение задачи/комментария из базы')
-def delete_document(document_id: int, db: Session = Depends(get_db)) -> Document:
-    deleted_document = crud_documents.delete_document(db=db, document_id=document_id)
+async def delete_document(document_id: int, db: AsyncSession = Depends(get_db)) -> Document:
+    deleted_document, file_paths = await crud_documents.delete_document(db=db, document_id=document_id)
     if deleted_document is None:
         raise HTTPException(status_code=404, detail="Документ не найден")
-    os.remove(deleted_document.file_path)
+    for file_path in file_paths:
+        await storage.file_io.run(storage.remove_file, file_path)
     return deleted_document
 
 
+@app.get("/search",
+         response_model=SearchPage,
+         summary='Ищет задачи проекта и пользовательские комментарии к ним по тексту')
+async def search(project_id: int,
+                 q: str = Query(min_length=1),
+                 limit: int = Query(default=20, ge=1, le=100),
+                 cursor: str = None,
+                 db: AsyncSession = Depends(get_db)) -> SearchPage:
+    after = None
+    if cursor:
+        try:
+            after = pagination.decode_search_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    hits = await crud_search.search(db=db, project_id=project_id, q=q, limit=limit + 1, after=after)
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = pagination.encode_search_cursor(hits[-1]["rank"], hits[-1]["entity"], hits[-1]["id"])
+    return responses.FastJSONResponse({"items": [dict(hit) for hit in hits], "next_cursor": next_cursor})
+
+
+@app.get("/projects/{project_id}/stats",
+         response_model=ProjectStats,
+         summary='Возвращает количество задач проекта и просроченных задач, в том числе по исполнителям')
+async def get_project_stats(project_id: int, db: AsyncSession = Depends(get_db)) -> ProjectStats:
+    today = datetime.now(timezone.utc).date()
+    executors = [
+        {**row, "executor_id": None if row["executor_id"] == crud_stats.NO_EXECUTOR else row["executor_id"]}
+        for row in await crud_stats.get_project_stats(db=db, project_id=project_id, today=today)
+    ]
+    return {
+        "project_id": project_id,
+        "task_count": sum(executor["task_count"] for executor in executors),
+        "overdue_count": sum(executor["overdue_count"] for executor in executors),
+        "executors": executors
+    }
+
+
+@app.get("/projects/{project_id}/export",
+         response_class=StreamingResponse,
+         summary='Выгружает задачи, комментарии и вложения проекта потоком в NDJSON или CSV')
+async def export_project(project_id: int,
+                         request: Request,
+                         format: export.ExportFormat = export.ExportFormat.ndjson) -> StreamingResponse:
+    compress = export.accepts_gzip(request.headers.get("accept-encoding"))
+    headers = {
+        "content-disposition": f'attachment; filename="project-{project_id}.{format.value}"',
+        "vary": "Accept-Encoding"
+    }
+    if compress:
+        headers["content-encoding"] = "gzip"
+    return StreamingResponse(
+        export_project_body(project_id, format, compress),
+        media_type=export.media_types[format],
+        headers=headers
+    )
+
+
+@app.get("/events",
+         response_class=StreamingResponse,
+         summary='Передает события об изменениях задач, комментариев и вложений проекта или задачи (SSE)')
+async def stream_events(request: Request,
+                        project_id: int = None,
+                        task_id: int = None) -> StreamingResponse:
+    subscription = subscribe_events(project_id, task_id)
+    return StreamingResponse(
+        sse_events_body(request, subscription),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"}
+    )
+
+
+@app.websocket("/events/ws")
+async def stream_events_ws(websocket: WebSocket,
+                           project_id: int = None,
+                           task_id: int = None):
+    if project_id is None and task_id is None:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = events.event_hub.subscribe(project_id, task_id)
+    # Сообщения клиента не ожидаются, их чтение нужно только чтобы заметить отключение
+    receiver = asyncio.create_task(receive_until_disconnect(websocket))
+    try:
+        while True:
+            event = asyncio.create_task(subscription.get())
+            await asyncio.wait((event, receiver), return_when=asyncio.FIRST_COMPLETED)
+            if not event.done():
+                event.cancel()
+                break
+            payload = event.result()
+            if payload is None:
+                await websocket.close(code=1013)
+                break
+            await websocket.send_text(payload)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        events.event_hub.unsubscribe(subscription)
+
+
+@app.get("/health/db",
+         response_model=DatabaseHealth,
+         summary='Возвращает состояние пула соединений с БД')
+async def get_db_health(response: Response) -> DatabaseHealth:
+    pool = DB_INITIALIZER.pool_stats()
+    status = "ok"
+    if is_pool_saturated(pool):
+        status = "saturated"
+        response.status_code = 503
+    return {"status": status, "pool": pool}
+
+
 @app.on_event("startup")
 async def on_startup():
+    await DB_INITIALIZER.init_database(
+        cfg.postgres_dsn_async.unicode_string(),
+        pool_size=cfg.db_pool_size,
+        max_overflow=cfg.db_max_overflow,
+        pool_timeout=cfg.db_pool_timeout,
+        pool_recycle=cfg.db_pool_recycle,
+        pool_pre_ping=cfg.db_pool_pre_ping,
+        statement_timeout=cfg.db_statement_timeout
+    )
+
     comment_types = []
     with open(cfg.default_comment_types_config_path, encoding="utf-8") as f:
         comment_types = json.load(f)
 
-    for db in get_db():
+    async for db in get_db():
         for comment_type in comment_types:
-            crud_comments.upsert_comment_type(
+            await crud_comments.upsert_comment_type(
                 db, CommentTypeUpsert(**comment_type)
             )
+        await crud_comments.upsert_change_set_type(db)
+        await crud_stats.rebuild_stats_if_empty(db)
+
+    await events.event_hub.start(DB_INITIALIZER.driver_connect_args(), cfg.events_queue_size)
+
+    app.state.idempotency_sweep_task = asyncio.create_task(
+        idempotency.sweep_periodically(cfg.idempotency_key_ttl, cfg.idempotency_pending_timeout)
+    )
+    app.state.reconcile_task = None
+    if cfg.storage_reconcile_interval > 0:
+        app.state.reconcile_task = asyncio.create_task(
+            reconcile_storage.run_periodically(cfg.storage_reconcile_interval)
+        )
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.idempotency_sweep_task.cancel()
+    if app.state.reconcile_task is not None:
+        app.state.reconcile_task.cancel()
+    await events.event_hub.stop()
+    storage.file_io.shutdown()
+
+
+async def export_project_body(project_id: int,
+                              export_format: export.ExportFormat,
+                              compress: bool) -> AsyncIterator[bytes]:
+    # Сессия открывается в самом генераторе, так как тело ответа читается уже после выхода из обработчика
+    async with DB_INITIALIZER.async_session_maker() as db:
+        rows = crud_export.stream_project(db, project_id, cfg.export_batch_size)
+        async for chunk in export.encode(rows, export_format, compress):
+            yield chunk
+
+
+def subscribe_events(project_id: int | None, task_id: int | None) -> events.Subscription:
+    if project_id is None and task_id is None:
+        raise HTTPException(status_code=400, detail="Нужно указать project_id или task_id")
+    return events.event_hub.subscribe(project_id, task_id)
+
+
+async def sse_events_body(request: Request, subscription: events.Subscription) -> AsyncIterator[str]:
+    # Комментарий-пульс не дает прокси закрыть простаивающее соединение и выявляет отключение клиента
+    try:
+        while not await request.is_disconnected():
+            try:
+                payload = await asyncio.wait_for(subscription.get(), cfg.events_heartbeat_interval)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if payload is None:
+                yield "event: overflow\ndata: {}\n\n"
+                break
+            yield f"data: {payload}\n\n"
+    finally:
+        events.event_hub.unsubscribe(subscription)
+
+
+async def receive_until_disconnect(websocket: WebSocket) -> None:
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+
+def version_conflict(version: int) -> HTTPException:
+    return HTTPException(
+        status_code=412,
+        detail="Задача была изменена, получите ее текущую версию",
+        headers={"etag": responses.version_etag(version)}
+    )
 
 
-def create_file_path(storage_path: str, extension: str):
-    return os.path.join(storage_path, str(uuid.uuid4()) + extension)
+def build_task_tree(tasks: List[models.Task]) -> TaskTree:
+    nodes = {}
+    for task in tasks:
+        node = TaskTree.model_validate(task, from_attributes=True)
+        if nodes:
+            nodes[task.parent_task_id].subtasks.append(node)
+        nodes[task.id] = node
+    return nodes[tasks[0].id]
 
 
-def create_file(file: UploadFile, file_path: str):
+async def remove_deleted_files(file_paths: List[str], blobs: List[str]) -> None:
+    """
+    Удаляет файлы удаленных вложений и блобы, на которые не осталось ссылок
+    """
+    if blobs:
+        async with DB_INITIALIZER.async_session_maker() as db:
+            await crud_documents.delete_unreferenced_blobs(db, blobs)
+    if file_paths:
+        await storage.file_io.run(storage.remove_files, file_paths)
+
+
+def document_etag(document: models.TaskDocument) -> str:
+    if document.sha256:
+        return f'"{document.sha256}"'
+    return f'"{document.id}-{int(document.create_date.timestamp())}"'
+
+
+async def create_file(db: AsyncSession, file: UploadFile, extension: str) -> Tuple[str, int, str]:
+    if file.size is not None and file.size > cfg.max_upload_size:
+        raise HTTPException(status_code=413, detail="Размер файла превышает допустимый")
+    try:
+        pending = await storage.file_io.run(blob_storage.write_temp, file.file)
+    except storage.UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Размер файла превышает допустимый")
+    except Exception:
+        raise HTTPException(status_code=500, detail="Ошибка при работе с файлом")
+    file_path = await crud_documents.acquire_blob(
+        db=db,
+        sha256=pending.sha256,
+        size=pending.size,
+        file_path=blob_storage.blob_path(pending.sha256, extension)
+    )
     try:
-        with open(file_path, "wb") as out_file:
-            out_file.write(file.file.read())
+        await storage.file_io.run(blob_storage.store, pending, file_path)
     except Exception:
+        await storage.file_io.run(blob_storage.discard, pending)
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при работе с файлом")
+    return file_path, pending.size, pending.sha256
@@ -0,0 +1,115 @@
+"""
+Сжимает историю изменений задач: системные комментарии прежнего формата (по строке на каждое
+измененное поле) одного обновления заменяются одной строкой change set. Комментарии одного
+обновления определяются по совпадению задачи, пользователя и времени создания.
+
+Запуск: python -m app.compact_comments [--batch-size 1000]
+
+Задачи обходятся пакетами по идентификатору, каждый пакет фиксируется отдельно, поэтому
+прерванное сжатие можно просто запустить повторно. Ответы API не меняются: change set
+разворачивается при чтении, но системные комментарии получают новые идентификаторы
+"""
+import argparse
+import asyncio
+import json
+import uuid
+from datetime import datetime
+from itertools import groupby
+from typing import List
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import DB_INITIALIZER, models
+from . import config, crud_comments, schemas
+
+legacy_type_ids = sorted(set(crud_comments.change_set_fields.values()))
+
+
+def legacy_change(data: dict) -> tuple:
+    """
+    Возвращает поле и пару (прежнее, новое) значений системного комментария прежнего формата
+    """
+    if "name" in data:
+        return "name", (data["early_name"], data["name"])
+    if "description" in data:
+        return "description", (None, None)
+    for field, parse in (("executor_id", uuid.UUID), ("completion_date", datetime.fromisoformat)):
+        if field in data:
+            return field, tuple(parse(value) if value else None for value in (data[f"early_{field}"], data[field]))
+    raise ValueError(f"Неизвестный формат системного комментария: {data}")
+
+
+def build_change_sets(rows: List) -> List[dict]:
+    """
+    Объединяет системные комментарии одного обновления в change set. Если поле повторяется
+    в одной группе, для него начинается следующий change set, чтобы не потерять изменения
+    """
+    change_sets = []
+    for (task_id, user_id, create_date), group in groupby(rows, key=lambda row: row[1:4]):
+        update_dict = {}
+        for row in group:
+            field, value = legacy_change(row.data)
+            if field in update_dict:
+                change_sets.append(crud_comments.build_change_set(task_id, user_id, create_date, update_dict))
+                update_dict = {}
+            update_dict[field] = value
+        change_sets.append(crud_comments.build_change_set(task_id, user_id, create_date, update_dict))
+    return change_sets
+
+
+async def compact_tasks(db: AsyncSession, task_ids: List[int]) -> int:
+    """
+    Заменяет системные комментарии задач change set и возвращает количество удаленных строк
+    """
+    rows = (await db.execute(
+        select(models.Comment.id,
+               models.Comment.task_id,
+               models.Comment.user_id,
+               models.Comment.create_date,
+               models.Comment.data)
+        .where(models.Comment.task_id.in_(task_ids), models.Comment.type_id.in_(legacy_type_ids))
+        .order_by(models.Comment.task_id, models.Comment.user_id, models.Comment.create_date, models.Comment.id)
+    )).all()
+    if not rows:
+        return 0
+    await db.execute(insert(models.Comment), build_change_sets(rows))
+    await db.execute(delete(models.Comment).where(models.Comment.id.in_([row.id for row in rows])))
+    return len(rows)
+
+
+async def compact(batch_size: int) -> None:
+    cfg = config.load_config()
+    await DB_INITIALIZER.init_database(cfg.postgres_dsn_async.unicode_string())
+    with open(cfg.default_comment_types_config_path, encoding="utf-8") as f:
+        comment_types = json.load(f)
+
+    async with DB_INITIALIZER.async_session_maker() as db:
+        for comment_type in comment_types:
+            await crud_comments.upsert_comment_type(db, schemas.CommentTypeUpsert(**comment_type))
+        await crud_comments.upsert_change_set_type(db)
+
+        last_task_id = 0
+        compacted = 0
+        while True:
+            task_ids = (await db.execute(
+                select(models.Task.id).where(models.Task.id > last_task_id).order_by(models.Task.id).limit(batch_size)
+            )).scalars().all()
+            if not task_ids:
+                return
+            compacted += await compact_tasks(db, task_ids)
+            await db.commit()
+            last_task_id = task_ids[-1]
+            print(f"Обработано задач до {last_task_id}, сжато комментариев: {compacted}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сжатие системных комментариев задач в change set")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(compact(args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
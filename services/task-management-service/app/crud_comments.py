@@ -1,15 +1,32 @@
 import uuid
 from datetime import datetime, timezone
-from typing import Any, List
+from typing import Any, List, Mapping, Tuple
 
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.dialects.postgresql import insert
 from .database import models
-from . import schemas
+from . import schemas, crud_documents, events
 
+# Столбцы схемы Comment, которые список выбирает без загрузки ORM-объектов
+comment_columns = (
+    models.Comment.id,
+    models.Comment.type_id,
+    models.Comment.task_id,
+    models.Comment.create_date,
+    models.Comment.update_date,
+    models.Comment.user_id,
+    models.Comment.data
+)
 
-def upsert_comment_type(db: Session, comment_type: schemas.CommentTypeUpsert) -> models.CommentType | None:
+# Тип комментария, одна строка которого хранит изменения всех полей задачи при одном обновлении
+CHANGE_SET_TYPE_ID = 5
+CHANGE_SET_TYPE_NAME = "change_set"
+# Порядок полей в change set и типы системных комментариев прежнего формата, в которые они разворачиваются
+change_set_fields = {"name": 1, "description": 1, "executor_id": 2, "completion_date": 3}
+
+
+async def upsert_comment_type(db: AsyncSession, comment_type: schemas.CommentTypeUpsert) -> models.CommentType | None:
     """
     Обновляет или добавляет тип комментария в БД
     """
@@ -19,31 +36,40 @@ def upsert_comment_type(db: Session, comment_type: schemas.CommentTypeUpsert) ->
         constraint='comment_type_pkey',
         set_={"name": comment_type.name}
     )
-    result = db.execute(stm)
+    result = await db.execute(stm)
 
-    db.commit()
+    await db.commit()
     if result:
-        return get_comment_type(db, comment_type.id)
+        return await get_comment_type(db, comment_type.id)
     return None
 
 
-def get_comment_type(db: Session,
-                     type_id: int) -> models.CommentType:
+async def upsert_change_set_type(db: AsyncSession) -> models.CommentType | None:
+    """
+    Добавляет тип комментария change set, без которого не записываются изменения задач,
+    независимо от файла типов комментариев по умолчанию
+    """
+    return await upsert_comment_type(
+        db, schemas.CommentTypeUpsert(id=CHANGE_SET_TYPE_ID, name=CHANGE_SET_TYPE_NAME)
+    )
+
+
+async def get_comment_type(db: AsyncSession,
+                           type_id: int) -> models.CommentType:
     """
     Возвращает информацию о типе комментария
     """
-    result = db.execute(select(models.CommentType).filter(models.CommentType.id == type_id).limit(1))
+    result = await db.execute(select(models.CommentType).filter(models.CommentType.id == type_id).limit(1))
     return result.scalars().one_or_none()
 
 
-def create_system_comment(db: Session,
-                          task_id: int,
-                          user_id: uuid.UUID,
-                          create_date: datetime,
-                          field: str,
-                          value: Any) -> models.Comment:
+def build_system_comment(task_id: int,
+                         user_id: uuid.UUID,
+                         create_date: datetime,
+                         field: str,
+                         value: Any) -> dict:
     """
-    Создает новый системный комментарий в БД
+    Формирует значения системного комментария об изменении поля задачи
     """
     data = {}
     type_id = 1
@@ -76,22 +102,93 @@ def create_system_comment(db: Session,
             data["early_completion_date"] = str(value[0])
             data["completion_date"] = str(value[1])
 
-    db_comment = models.Comment(
-        user_id=user_id,
-        data=data,
-        create_date=create_date,
-        type_id=type_id,
-        task_id=task_id
-    )
+    return {
+        "id": uuid.uuid4(),
+        "user_id": user_id,
+        "data": data,
+        "create_date": create_date,
+        "type_id": type_id,
+        "task_id": task_id
+    }
+
+
+def build_change_set(task_id: int,
+                     user_id: uuid.UUID,
+                     create_date: datetime,
+                     update_dict: dict) -> dict:
+    """
+    Формирует значения комментария change set: для каждого измененного поля пара [прежнее, новое]
+    значений JSON-типов (UUID и дата - строками, отсутствие значения - null). Текст описания,
+    как и в системных комментариях прежнего формата, не сохраняется
+    """
+    data = {}
+    for field, value in update_dict.items():
+        if field == "description":
+            data[field] = [None, None]
+        else:
+            data[field] = [to_change_set_value(item) for item in value]
+
+    return {
+        "id": uuid.uuid4(),
+        "user_id": user_id,
+        "data": data,
+        "create_date": create_date,
+        "type_id": CHANGE_SET_TYPE_ID,
+        "task_id": task_id
+    }
 
-    db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-    return db_comment
 
+def to_change_set_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
 
-def create_user_comment(db: Session,
-                        comment: schemas.UserCommentCreate) -> models.Comment:
+
+def from_change_set_value(field: str, value: Any) -> Any:
+    if field == "completion_date" and value is not None:
+        return datetime.fromisoformat(value)
+    return value
+
+
+def expand_comment(comment: Mapping) -> List[Mapping]:
+    """
+    Разворачивает change set в системные комментарии прежнего формата, по одному на поле,
+    с постоянными идентификаторами uuid5 от идентификатора change set и имени поля.
+    Остальные комментарии возвращаются без изменений
+    """
+    if comment["type_id"] != CHANGE_SET_TYPE_ID:
+        return [comment]
+    comments = []
+    for field in change_set_fields:
+        if field not in comment["data"]:
+            continue
+        value = tuple(from_change_set_value(field, item) for item in comment["data"][field])
+        system_comment = build_system_comment(
+            comment["task_id"], comment["user_id"], comment["create_date"], field, value
+        )
+        comments.append({**comment, **system_comment, "id": uuid.uuid5(comment["id"], field)})
+    return comments
+
+
+async def create_system_comments(db: AsyncSession,
+                                 task_id: int,
+                                 user_id: uuid.UUID,
+                                 create_date: datetime,
+                                 update_dict: dict) -> None:
+    """
+    Добавляет изменения всех полей одной строкой change set,
+    фиксация транзакции остается за вызывающей стороной
+    """
+    if not update_dict:
+        return
+
+    await db.execute(insert(models.Comment).values(build_change_set(task_id, user_id, create_date, update_dict)))
+
+
+async def create_user_comment(db: AsyncSession,
+                              comment: schemas.UserCommentCreate) -> models.Comment:
     """
     Создает новый пользовательский комментарий в БД
     """
@@ -105,77 +202,97 @@ def create_user_comment(db: Session,
     )
 
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
+    await db.flush()
+    await events.publish(db, "comment", "created", comment.task_id, db_comment.id)
+    await db.commit()
+    await db.refresh(db_comment)
     return db_comment
 
 
-def get_comments(db: Session,
-                 task_id: int) -> List[models.Comment]:
+async def get_comments(db: AsyncSession,
+                       task_id: int) -> List[Mapping]:
     """
-    Возвращает инфомрмацию о задачах
+    Возвращает инфомрмацию о комментариях задачи в виде строк со столбцами схемы Comment,
+    change set разворачиваются в системные комментарии прежнего формата
     """
-    return (db.query(models.Comment)
-            .filter(models.Comment.task_id == task_id)
-            .order_by(models.Comment.create_date)
-            .all())
+    result = await db.execute(select(*comment_columns)
+                              .filter(models.Comment.task_id == task_id)
+                              .order_by(models.Comment.create_date))
+    return [expanded for comment in result.mappings() for expanded in expand_comment(comment)]
 
 
-def get_comment(db: Session,
-                comment_id: uuid.UUID) -> models.Comment | None:
+async def get_comments_version(db: AsyncSession,
+                               task_id: int) -> Tuple[int, datetime | None]:
+    """
+    Возвращает количество комментариев задачи и время последнего изменения среди них
+    """
+    result = await db.execute(
+        select(func.count(), func.max(func.coalesce(models.Comment.update_date, models.Comment.create_date)))
+        .filter(models.Comment.task_id == task_id)
+    )
+    return result.one()
+
+
+async def get_comment(db: AsyncSession,
+                      comment_id: uuid.UUID) -> models.Comment | None:
     """
     Возвращает информацию о комментарии
     """
-    return (db.query(models.Comment)
-            .filter(models.Comment.id == comment_id)
-            .first())
+    result = await db.execute(select(models.Comment).filter(models.Comment.id == comment_id).limit(1))
+    return result.scalars().one_or_none()
 
 
-def get_task_comment(db: Session,
-                     task_id: int,
-                     comment_id: uuid.UUID | None) -> models.Comment | None:
+async def get_task_comment(db: AsyncSession,
+                           task_id: int,
+                           comment_id: uuid.UUID | None) -> models.Comment | None:
     """
     Возвращает информацию о комментарии задачи
     """
-    return (db.query(models.Comment)
-            .filter(models.Comment.id == comment_id, models.Comment.task_id == task_id)
-            .first())
+    result = await db.execute(select(models.Comment)
+                              .filter(models.Comment.id == comment_id, models.Comment.task_id == task_id)
+                              .limit(1))
+    return result.scalars().one_or_none()
 
 
-def update_user_comment(db: Session,
-                        comment_id: uuid.UUID,
-                        comment: schemas.UserCommentUpdate) -> models.Comment | None:
+async def update_user_comment(db: AsyncSession,
+                              comment_id: uuid.UUID,
+                              comment: schemas.UserCommentUpdate) -> models.Comment | None:
     """
     Обновляет пользовательский комментарий
     """
     data = {"message": comment.message}
-    result = (db.query(models.Comment)
-              .filter(models.Comment.id == comment_id)
-              .update({"data": data}))
+    task_id = (await db.execute(update(models.Comment)
+                                .filter(models.Comment.id == comment_id)
+                                .values(data=data, update_date=datetime.now(timezone.utc))
+                                .returning(models.Comment.task_id))).scalar_one_or_none()
+    if task_id is not None:
+        await events.publish(db, "comment", "updated", task_id, comment_id)
 
-    db.commit()
+    await db.commit()
 
-    if result == 1:
-        return get_comment(db, comment_id)
+    if task_id is not None:
+        return await get_comment(db, comment_id)
     return None
 
 
-def delete_comment(db: Session,
-                   comment_id: uuid.UUID) -> tuple[models.Comment, List[str]] | tuple[None, None]:
+async def delete_comment(db: AsyncSession,
+                         comment_id: uuid.UUID) -> tuple[models.Comment, List[str]] | tuple[None, None]:
     """
-    Удаляет пользовательский комментарий
+    Удаляет пользовательский комментарий. Вложения комментария удаляются до него самого, чтобы
+    счетчики ссылок блобов уменьшались по строкам, удаленным этим запросом, а не каскадно
     """
-    deleted_comment = get_comment(db, comment_id)
-    file_paths = []
-    if deleted_comment:
-        for document in deleted_comment.documents:
-            file_paths.append(document.file_path)
-    result = (db.query(models.Comment)
-              .filter(models.Comment.id == comment_id, models.Comment.type_id == 4)
-              .delete())
+    deleted_comment = await get_comment(db, comment_id)
+    if deleted_comment is None or deleted_comment.type_id != 4:
+        return None, None
 
-    db.commit()
+    file_paths, blobs = await crud_documents.delete_documents(db, models.TaskDocument.comment_id == comment_id)
+    result = await db.execute(delete(models.Comment)
+                              .filter(models.Comment.id == comment_id, models.Comment.type_id == 4))
+    if result.rowcount != 1:
+        await db.rollback()
+        return None, None
+    await events.publish(db, "comment", "deleted", deleted_comment.task_id, comment_id)
 
-    if result == 1:
-        return deleted_comment, file_paths
-    return None, None
+    await db.commit()
+    await crud_documents.delete_unreferenced_blobs(db, blobs)
+    return deleted_comment, file_paths
@@ -1,19 +1,38 @@
 import uuid
+from collections import Counter
 from datetime import datetime, timezone
-from typing import List
+from typing import List, Tuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .database import models
-from . import schemas
+from . import schemas, storage, events
 
+# Столбцы схемы Document, которые список выбирает без загрузки ORM-объектов
+document_columns = (
+    models.TaskDocument.id,
+    models.TaskDocument.task_id,
+    models.TaskDocument.comment_id,
+    models.TaskDocument.user_id,
+    models.TaskDocument.name,
+    models.TaskDocument.file_path,
+    models.TaskDocument.size,
+    models.TaskDocument.sha256,
+    models.TaskDocument.create_date
+)
 
-def create_document(db: Session,
-                    file_name: str,
-                    file_path: str,
-                    task_id: int,
-                    user_id: uuid.UUID,
-                    comment_id: uuid.UUID = None) -> models.TaskDocument:
+
+async def create_document(db: AsyncSession,
+                          file_name: str,
+                          file_path: str,
+                          size: int,
+                          sha256: str,
+                          task_id: int,
+                          user_id: uuid.UUID,
+                          comment_id: uuid.UUID = None) -> models.TaskDocument:
     """
     Создает новый документ в БД
     """
@@ -21,51 +40,148 @@ def create_document(db: Session,
         user_id=user_id,
         name=file_name,
         file_path=file_path,
+        size=size,
+        sha256=sha256,
         create_date=datetime.now(timezone.utc),
         task_id=task_id,
         comment_id=comment_id
     )
 
     db.add(db_document)
-    db.commit()
-    db.refresh(db_document)
+    await db.flush()
+    await events.publish(db, "document", "created", task_id, db_document.id)
+    await db.commit()
+    await db.refresh(db_document)
     return db_document
 
 
-def get_documents(db: Session,
-                  task_id: int,
-                  comment_id: uuid.UUID | None) -> List[models.TaskDocument]:
+async def get_documents(db: AsyncSession,
+                        task_id: int,
+                        comment_id: uuid.UUID | None) -> List[RowMapping]:
+    """
+    Возвращает вложения в виде строк со столбцами схемы Document
+    """
+    result = await db.execute(select(*document_columns)
+                              .filter(models.TaskDocument.task_id == task_id,
+                                      models.TaskDocument.comment_id == comment_id)
+                              .order_by(models.TaskDocument.create_date))
+    return result.mappings().all()
+
+
+async def get_documents_version(db: AsyncSession,
+                                task_id: int,
+                                comment_id: uuid.UUID | None) -> Tuple[int, datetime | None]:
     """
-    Возвращает вложения
+    Возвращает количество вложений и время добавления последнего из них
     """
-    return (db.query(models.TaskDocument)
-            .filter(models.TaskDocument.task_id == task_id, models.TaskDocument.comment_id == comment_id)
-            .order_by(models.TaskDocument.create_date)
-            .all())
+    result = await db.execute(
+        select(func.count(), func.max(models.TaskDocument.create_date))
+        .filter(models.TaskDocument.task_id == task_id, models.TaskDocument.comment_id == comment_id)
+    )
+    return result.one()
 
 
-def get_document(db: Session,
-                 document_id: int) -> models.TaskDocument | None:
+async def get_document(db: AsyncSession,
+                       document_id: int) -> models.TaskDocument | None:
     """
     Возвращает вложение
     """
-    return (db.query(models.TaskDocument)
-            .filter(models.TaskDocument.id == document_id)
-            .first())
+    result = await db.execute(select(models.TaskDocument).filter(models.TaskDocument.id == document_id).limit(1))
+    return result.scalars().one_or_none()
+
+
+async def delete_document(db: AsyncSession,
+                          document_id: int) -> tuple[models.TaskDocument, List[str]] | tuple[None, None]:
+    """
+    Удаляет вложение. Счетчик ссылок блоба уменьшается по строке из DELETE ... RETURNING, поэтому
+    при параллельном удалении того же вложения его уменьшает только удаливший запрос
+    """
+    deleted_document = (await db.execute(
+        delete(models.TaskDocument)
+        .where(models.TaskDocument.id == document_id)
+        .returning(models.TaskDocument)
+        .execution_options(synchronize_session=False)
+    )).scalars().one_or_none()
+    if deleted_document is None:
+        await db.rollback()
+        return None, None
+
+    file_paths, blobs = await release_blobs(db, [(deleted_document.file_path, deleted_document.sha256)])
+    await events.publish(db, "document", "deleted", deleted_document.task_id, document_id)
+
+    await db.commit()
+    await delete_unreferenced_blobs(db, blobs)
+    return deleted_document, file_paths
+
+
+async def acquire_blob(db: AsyncSession,
+                       sha256: str,
+                       size: int,
+                       file_path: str) -> str:
+    """
+    Учитывает новую ссылку на блоб (создает его запись при первой ссылке) и возвращает путь к файлу блоба.
+    Транзакция не фиксируется
+    """
+    stm = insert(models.DocumentBlob).values(
+        sha256=sha256,
+        file_path=file_path,
+        size=size,
+        ref_count=1,
+        create_date=datetime.now(timezone.utc)
+    )
+    stm = stm.on_conflict_do_update(
+        index_elements=[models.DocumentBlob.sha256],
+        set_={"ref_count": models.DocumentBlob.ref_count + 1}
+    ).returning(models.DocumentBlob.file_path)
+    return (await db.execute(stm)).scalar_one()
+
+
+async def delete_documents(db: AsyncSession, *criteria) -> Tuple[List[str], List[str]]:
+    """
+    Удаляет вложения по условиям criteria одним DELETE ... RETURNING и уменьшает счетчики ссылок блобов
+    только у действительно удаленных строк. Возвращает пути файлов вложений, сохраненных вне хранилища
+    блобов, и хэши затронутых блобов. Транзакция не фиксируется
+    """
+    rows = (await db.execute(
+        delete(models.TaskDocument)
+        .where(*criteria)
+        .returning(models.TaskDocument.file_path, models.TaskDocument.sha256)
+        .execution_options(synchronize_session=False)
+    )).all()
+    return await release_blobs(db, rows)
 
 
-def delete_document(db: Session,
-                    document_id: int) -> models.TaskDocument | None:
+async def release_blobs(db: AsyncSession, rows: List[Tuple[str, str | None]]) -> Tuple[List[str], List[str]]:
     """
-    Удаляет вложение
+    Уменьшает счетчики ссылок блобов по строкам (file_path, sha256) удаляемых вложений.
+    Транзакция не фиксируется
     """
-    deleted_document = get_document(db, document_id)
-    result = (db.query(models.TaskDocument)
-              .filter(models.TaskDocument.id == document_id)
-              .delete())
+    file_paths = [file_path for file_path, sha256 in rows if not storage.is_blob_path(file_path, sha256)]
+    released = Counter(sha256 for file_path, sha256 in rows if storage.is_blob_path(file_path, sha256))
+    if released:
+        await db.execute(
+            update(models.DocumentBlob)
+            .where(models.DocumentBlob.sha256.in_(released))
+            .values(ref_count=models.DocumentBlob.ref_count - case(released, value=models.DocumentBlob.sha256))
+            .execution_options(synchronize_session=False)
+        )
+    return file_paths, list(released)
 
-    db.commit()
 
-    if result == 1:
-        return deleted_document
-    return None
+async def delete_unreferenced_blobs(db: AsyncSession,
+                                    blobs: List[str]) -> List[str]:
+    """
+    Удаляет блобы, на которые не осталось ссылок, вместе с их файлами. Файлы удаляются до фиксации
+    транзакции, пока строки блобов заблокированы, поэтому параллельная загрузка того же содержимого
+    дождется удаления и запишет файл заново
+    """
+    if not blobs:
+        return []
+    file_paths = (await db.execute(
+        delete(models.DocumentBlob)
+        .where(models.DocumentBlob.sha256.in_(blobs), models.DocumentBlob.ref_count <= 0)
+        .returning(models.DocumentBlob.file_path)
+    )).scalars().all()
+    await storage.file_io.run(storage.remove_files, file_paths)
+    await db.commit()
+    return file_paths
@@ -0,0 +1,57 @@
+from typing import AsyncIterator, Mapping, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import models
+from . import crud_comments
+
+
+async def stream_project(db: AsyncSession,
+                         project_id: int,
+                         batch_size: int) -> AsyncIterator[Tuple[str, Mapping]]:
+    """
+    Последовательно выдает задачи, комментарии и вложения проекта, читая их через серверный курсор
+    порциями по batch_size строк, без загрузки всего проекта в память. Change set выдаются
+    системными комментариями прежнего формата
+    """
+    project_tasks = select(models.Task.id).where(models.Task.project_id == project_id)
+    queries = (
+        ("task", select(models.Task.id,
+                        models.Task.parent_task_id,
+                        models.Task.name,
+                        models.Task.description,
+                        models.Task.creator_id,
+                        models.Task.executor_id,
+                        models.Task.create_date,
+                        models.Task.update_date,
+                        models.Task.completion_date)
+         .where(models.Task.project_id == project_id)
+         .order_by(models.Task.id)),
+        ("comment", select(models.Comment.id,
+                           models.Comment.task_id,
+                           models.Comment.type_id,
+                           models.Comment.user_id,
+                           models.Comment.data,
+                           models.Comment.create_date)
+         .where(models.Comment.task_id.in_(project_tasks))
+         .order_by(models.Comment.task_id, models.Comment.create_date)),
+        ("document", select(models.TaskDocument.id,
+                            models.TaskDocument.task_id,
+                            models.TaskDocument.comment_id,
+                            models.TaskDocument.name,
+                            models.TaskDocument.user_id,
+                            models.TaskDocument.size,
+                            models.TaskDocument.sha256,
+                            models.TaskDocument.create_date)
+         .where(models.TaskDocument.task_id.in_(project_tasks))
+         .order_by(models.TaskDocument.task_id, models.TaskDocument.id)),
+    )
+    for entity, query in queries:
+        result = await db.stream(query.execution_options(yield_per=batch_size))
+        async for row in result.mappings():
+            if entity == "comment":
+                for comment in crud_comments.expand_comment(row):
+                    yield entity, comment
+            else:
+                yield entity, row
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+from typing import Tuple
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import models
+
+
+async def acquire_key(db: AsyncSession,
+                      key: str,
+                      request: str,
+                      fingerprint: str) -> Tuple[bool, models.IdempotencyKey | None]:
+    """
+    Регистрирует ключ как выполняемый. Возвращает True, если ключ зарегистрирован этим вызовом,
+    иначе False и текущую запись ключа (None, если она успела удалиться)
+    """
+    acquired = (await db.execute(
+        insert(models.IdempotencyKey)
+        .values(key=key, request=request, fingerprint=fingerprint, create_date=datetime.now(timezone.utc))
+        .on_conflict_do_nothing(index_elements=[models.IdempotencyKey.key])
+        .returning(models.IdempotencyKey.key)
+    )).scalar_one_or_none()
+    await db.commit()
+    if acquired is not None:
+        return True, None
+    result = await db.execute(select(models.IdempotencyKey).where(models.IdempotencyKey.key == key))
+    return False, result.scalar_one_or_none()
+
+
+async def complete_key(db: AsyncSession,
+                       key: str,
+                       status_code: int,
+                       content_type: str | None,
+                       body: bytes) -> None:
+    """
+    Сохраняет ответ на запрос с ключом
+    """
+    await db.execute(
+        update(models.IdempotencyKey)
+        .where(models.IdempotencyKey.key == key)
+        .values(status_code=status_code, content_type=content_type, body=body)
+    )
+    await db.commit()
+
+
+async def release_key(db: AsyncSession, key: str) -> None:
+    """
+    Удаляет ключ запроса, который завершился ошибкой, чтобы его можно было повторить
+    """
+    await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.key == key))
+    await db.commit()
+
+
+async def delete_expired_keys(db: AsyncSession, ttl: float, pending_timeout: float) -> int:
+    """
+    Удаляет ключи с ответами старше ttl секунд и ключи запросов, не завершившихся за pending_timeout
+    секунд (например, из-за остановки процесса)
+    """
+    now = datetime.now(timezone.utc)
+    result = await db.execute(
+        delete(models.IdempotencyKey)
+        .where(or_(
+            models.IdempotencyKey.create_date < now - timedelta(seconds=ttl),
+            models.IdempotencyKey.status_code.is_(None)
+            & (models.IdempotencyKey.create_date < now - timedelta(seconds=pending_timeout))
+        ))
+    )
+    await db.commit()
+    return result.rowcount
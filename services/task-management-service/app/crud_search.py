@@ -0,0 +1,54 @@
+from typing import List, Tuple
+
+from sqlalchemy import String, and_, cast, func, literal, null, or_, select, tuple_, union_all
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import models
+
+
+async def search(db: AsyncSession,
+                 project_id: int,
+                 q: str,
+                 limit: int,
+                 after: Tuple[float, str, str] | None = None) -> List[RowMapping]:
+    """
+    Ищет задачи проекта по названию и описанию и пользовательские комментарии к ним по тексту.
+    Результаты упорядочены по убыванию ts_rank, при равном ранге - по (entity, id), и начинаются
+    после ключа after. Совпадения находятся по GIN-индексам поисковых векторов
+    """
+    query = func.websearch_to_tsquery(models.SEARCH_CONFIG, q)
+    task_hits = (
+        select(literal("task").label("entity"),
+               cast(models.Task.id, String).label("id"),
+               models.Task.id.label("task_id"),
+               models.Task.name.label("task_name"),
+               cast(null(), String).label("message"),
+               func.ts_rank(models.Task.search_vector, query).label("rank"))
+        .where(models.Task.project_id == project_id, models.Task.search_vector.bool_op("@@")(query))
+    )
+    comment_hits = (
+        select(literal("comment").label("entity"),
+               cast(models.Comment.id, String).label("id"),
+               models.Comment.task_id,
+               models.Task.name.label("task_name"),
+               models.Comment.data["message"].astext.label("message"),
+               func.ts_rank(models.Comment.search_vector, query).label("rank"))
+        .join(models.Task, models.Task.id == models.Comment.task_id)
+        .where(models.Task.project_id == project_id,
+               models.Comment.type_id == 4,
+               models.Comment.search_vector.bool_op("@@")(query))
+    )
+    hits = union_all(task_hits, comment_hits).subquery("hits")
+
+    statement = select(hits)
+    if after is not None:
+        rank, entity, item_id = after
+        statement = statement.where(or_(
+            hits.c.rank < rank,
+            and_(hits.c.rank == rank, tuple_(hits.c.entity, hits.c.id) > tuple_(entity, item_id))
+        ))
+    result = await db.execute(
+        statement.order_by(hits.c.rank.desc(), hits.c.entity, hits.c.id).limit(limit)
+    )
+    return result.mappings().all()
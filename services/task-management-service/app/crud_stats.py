@@ -0,0 +1,84 @@
+import uuid
+from collections import Counter
+from datetime import date, datetime, timezone
+from typing import List, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import models
+
+# Значения ключа для задач без исполнителя и без срока: столбцы первичного ключа не допускают NULL
+NO_EXECUTOR = uuid.UUID(int=0)
+NO_DUE_DATE = date.max
+
+
+def stats_key(project_id: int,
+              executor_id: uuid.UUID | None,
+              completion_date: datetime | None) -> Tuple[int, uuid.UUID, date]:
+    """
+    Возвращает ключ строки task_stats, под которым учитывается задача. Срок округляется до дня по UTC
+    """
+    due_date = completion_date.astimezone(timezone.utc).date() if completion_date else NO_DUE_DATE
+    return project_id, executor_id or NO_EXECUTOR, due_date
+
+
+async def apply_stats_delta(db: AsyncSession, delta: Counter) -> None:
+    """
+    Прибавляет к счетчикам task_stats изменения delta одним INSERT ... ON CONFLICT.
+    Ключи сортируются, чтобы параллельные транзакции блокировали строки в одном порядке.
+    Транзакция не фиксируется
+    """
+    rows = [
+        {"project_id": project_id, "executor_id": executor_id, "due_date": due_date, "task_count": count}
+        for (project_id, executor_id, due_date), count in sorted(delta.items()) if count
+    ]
+    if not rows:
+        return
+    stm = insert(models.TaskStats).values(rows)
+    stm = stm.on_conflict_do_update(
+        index_elements=[models.TaskStats.project_id, models.TaskStats.executor_id, models.TaskStats.due_date],
+        set_={"task_count": models.TaskStats.task_count + stm.excluded.task_count}
+    )
+    await db.execute(stm)
+
+
+async def rebuild_stats_if_empty(db: AsyncSession) -> None:
+    """
+    Заполняет task_stats по существующим задачам, если таблица пуста (например, при первом запуске).
+    Блокировка на время транзакции не дает нескольким экземплярам сервиса заполнить ее дважды
+    """
+    await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(models.TaskStats.__tablename__))))
+    if (await db.execute(select(models.TaskStats.project_id).limit(1))).first() is None:
+        due_date = func.coalesce(
+            func.date(func.timezone("UTC", models.Task.completion_date)), NO_DUE_DATE
+        )
+        executor_id = func.coalesce(models.Task.executor_id, NO_EXECUTOR)
+        await db.execute(insert(models.TaskStats).from_select(
+            ["project_id", "executor_id", "due_date", "task_count"],
+            select(models.Task.project_id, executor_id, due_date, func.count())
+            .group_by(models.Task.project_id, executor_id, due_date)
+        ))
+    await db.commit()
+
+
+async def get_project_stats(db: AsyncSession,
+                            project_id: int,
+                            today: date) -> List[RowMapping]:
+    """
+    Возвращает по каждому исполнителю проекта количество задач и просроченных задач
+    (со сроком раньше today) одним GROUP BY по строкам task_stats проекта
+    """
+    result = await db.execute(
+        select(models.TaskStats.executor_id,
+               func.sum(models.TaskStats.task_count).label("task_count"),
+               func.coalesce(
+                   func.sum(models.TaskStats.task_count).filter(models.TaskStats.due_date < today), 0
+               ).label("overdue_count"))
+        .where(models.TaskStats.project_id == project_id, models.TaskStats.task_count > 0)
+        .group_by(models.TaskStats.executor_id)
+        .order_by(models.TaskStats.executor_id)
+    )
+    return result.mappings().all()
@@ -1,13 +1,68 @@
+import uuid
+from collections import Counter
 from datetime import datetime, timezone
 from typing import List, Tuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy import Integer, all_, any_, bindparam, delete, func, insert, literal, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY, array
+from sqlalchemy.engine import Row, RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .database import models
-from . import schemas
+from . import schemas, crud_comments, crud_documents, crud_stats, events
 
+# Столбцы схемы Task, которые списки выбирают без загрузки ORM-объектов
+task_columns = (
+    models.Task.id,
+    models.Task.name,
+    models.Task.description,
+    models.Task.executor_id,
+    models.Task.completion_date,
+    models.Task.project_id,
+    models.Task.parent_task_id,
+    models.Task.creator_id,
+    models.Task.create_date,
+    models.Task.update_date,
+    models.Task.version
+)
 
-def create_task(db: Session, task: schemas.TaskCreate) -> models.Task:
+# Поля задачи, которые меняют PUT и PATCH
+task_update_fields = ("name", "description", "executor_id", "completion_date")
+
+# Сколько раз обновление повторяется, если задачу параллельно изменяют другие запросы
+MAX_UPDATE_ATTEMPTS = 5
+
+
+class VersionConflict(Exception):
+    """
+    Версия задачи не совпала с переданной в If-Match
+    """
+
+    def __init__(self, version: int) -> None:
+        super().__init__(version)
+        self.version = version
+
+
+class UpdateConflict(Exception):
+    """
+    Задачу не удалось обновить за MAX_UPDATE_ATTEMPTS попыток: ее непрерывно изменяют другие запросы
+    """
+
+
+def normalize_update_values(values: dict) -> dict:
+    """
+    Приводит даты к UTC, чтобы сравнение с прочитанными из БД значениями (с часовым поясом)
+    совпадало со сравнением в БД. Даты без часового пояса считаются датами в UTC
+    """
+    normalized = {}
+    for field, value in values.items():
+        if isinstance(value, datetime):
+            value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+        normalized[field] = value
+    return normalized
+
+
+async def create_task(db: AsyncSession, task: schemas.TaskCreate) -> models.Task:
     """
     Создает новую задачу в БД
     """
@@ -23,108 +78,351 @@ def create_task(db: Session, task: schemas.TaskCreate) -> models.Task:
     )
 
     db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
+    await db.flush()
+    await events.publish(db, "task", "created", db_task.id, db_task.id, task.project_id)
+    await crud_stats.apply_stats_delta(db, Counter([
+        crud_stats.stats_key(task.project_id, task.executor_id, task.completion_date)
+    ]))
+    await db.commit()
+    await db.refresh(db_task)
     return db_task
 
 
-def get_tasks(db: Session,
-              project_id: int,
-              parent_task_id: int | None) -> List[models.Task]:
+async def create_tasks(db: AsyncSession, tasks: List[schemas.TaskBatchItem]) -> List[int]:
     """
-    Возвращает инфомрмацию о задачах
+    Создает пакет задач в одной транзакции. Идентификаторы выделяются заранее из последовательности
+    таблицы, поэтому ссылки на родительские задачи пакета разрешаются до вставки, а сама вставка
+    выполняется одним пакетным INSERT без RETURNING
     """
-    return (db.query(models.Task)
-            .filter(models.Task.project_id == project_id, models.Task.parent_task_id == parent_task_id)
-            .order_by(models.Task.create_date)
-            .all())
+    parents = resolve_batch_parents(tasks)
+    if not tasks:
+        return []
+
+    ids = sorted((await db.execute(
+        select(func.nextval(func.pg_get_serial_sequence(models.Task.__tablename__, "id")))
+        .select_from(func.generate_series(1, len(tasks)))
+    )).scalars().all())
+    create_date = datetime.now(timezone.utc)
+
+    await db.execute(insert(models.Task), [
+        {
+            "id": task_id,
+            "name": task.name,
+            "description": task.description,
+            "project_id": task.project_id,
+            "parent_task_id": task.parent_task_id if parent is None else ids[parent],
+            "creator_id": task.creator_id,
+            "executor_id": task.executor_id,
+            "completion_date": task.completion_date,
+            "create_date": create_date
+        }
+        for task_id, task, parent in zip(ids, tasks, parents)
+    ])
+    await crud_stats.apply_stats_delta(db, Counter(
+        crud_stats.stats_key(task.project_id, task.executor_id, task.completion_date) for task in tasks
+    ))
+    for project_id in {task.project_id for task in tasks}:
+        await events.publish(db, "task", "created", None, project_id=project_id)
+    await db.commit()
+    return ids
 
 
-def get_task(db: Session,
-             task_id: int) -> models.Task | None:
+def resolve_batch_parents(tasks: List[schemas.TaskBatchItem]) -> List[int | None]:
     """
-    Возвращает информацию о конкретной задаче/подзадаче
+    Возвращает для каждой задачи пакета позицию ее родительской задачи в пакете (по parent_temp_id).
+    Проверяет уникальность temp_id, существование родителя, совпадение проекта и отсутствие циклов,
+    при ошибке выбрасывает ValueError
     """
-    return (db.query(models.Task)
-            .filter(models.Task.id == task_id)
-            .first())
+    positions = {}
+    for position, task in enumerate(tasks):
+        if task.temp_id is None:
+            continue
+        if task.temp_id in positions:
+            raise ValueError(f"Повторяющийся temp_id: {task.temp_id}")
+        positions[task.temp_id] = position
+
+    parents = []
+    for task in tasks:
+        if task.parent_temp_id is None:
+            parents.append(None)
+            continue
+        if task.parent_task_id is not None:
+            raise ValueError("Нельзя одновременно указывать parent_task_id и parent_temp_id")
+        parent = positions.get(task.parent_temp_id)
+        if parent is None:
+            raise ValueError(f"Родительская задача не найдена в пакете: {task.parent_temp_id}")
+        if tasks[parent].project_id != task.project_id:
+            raise ValueError(f"Родительская задача {task.parent_temp_id} относится к другому проекту")
+        parents.append(parent)
+
+    # 0 - не посещена, 1 - на текущем пути, 2 - путь до корня проверен
+    states = [0] * len(tasks)
+    for start in range(len(tasks)):
+        path = []
+        position = start
+        while position is not None and states[position] == 0:
+            states[position] = 1
+            path.append(position)
+            position = parents[position]
+        if position is not None and states[position] == 1:
+            raise ValueError(f"Цикл в ссылках на родительские задачи: {tasks[position].temp_id}")
+        for position in path:
+            states[position] = 2
+    return parents
 
 
-def update_task(db: Session,
-                task_id: int,
-                create_date: datetime,
-                task: schemas.TaskUpdate) -> Tuple[dict | None, models.Task | None]:
+async def get_tasks(db: AsyncSession,
+                    project_id: int,
+                    parent_task_id: int | None,
+                    limit: int,
+                    after: Tuple[datetime, int] | None = None) -> List[RowMapping]:
     """
-    Обновляет информацию о задаче/подзадаче
+    Возвращает инфомрмацию о задачах, следующих за ключом (create_date, id) after,
+    в виде строк со столбцами схемы Task
     """
-    current_task = get_task(db, task_id)
-    update_dict = {}
+    query = (select(*task_columns)
+             .filter(models.Task.project_id == project_id, models.Task.parent_task_id == parent_task_id))
+    if after is not None:
+        query = query.filter(tuple_(models.Task.create_date, models.Task.id) > tuple_(*after))
+    result = await db.execute(query.order_by(models.Task.create_date, models.Task.id).limit(limit))
+    return result.mappings().all()
 
-    if not current_task:
-        return update_dict, None
 
-    for field, value in task.model_dump(exclude={"user_id"}).items():
-        current_value = getattr(current_task, field)
-        if current_value != value:
-            update_dict[field] = current_value, value
+async def get_assigned_tasks(db: AsyncSession,
+                             executor_id: uuid.UUID,
+                             due_before: datetime | None,
+                             limit: int,
+                             after: Tuple[datetime | None, int] | None = None) -> List[RowMapping]:
+    """
+    Возвращает задачи исполнителя по всем проектам, упорядоченные по (completion_date, id),
+    задачи без срока идут последними. Задачи со сроком и без срока выбираются отдельными
+    запросами, каждый из которых читает частичный индекс по исполнителю по порядку, без сортировки
+    """
+    query = select(*task_columns).filter(models.Task.executor_id == executor_id)
+    tasks = []
+    if after is None or after[0] is not None:
+        dated = query.filter(models.Task.completion_date.is_not(None))
+        if due_before is not None:
+            dated = dated.filter(models.Task.completion_date < due_before)
+        if after is not None:
+            dated = dated.filter(tuple_(models.Task.completion_date, models.Task.id) > tuple_(*after))
+        result = await db.execute(dated.order_by(models.Task.completion_date, models.Task.id).limit(limit))
+        tasks = result.mappings().all()
+    if len(tasks) < limit and due_before is None:
+        undated = query.filter(models.Task.completion_date.is_(None))
+        if after is not None and after[0] is None:
+            undated = undated.filter(models.Task.id > after[1])
+        result = await db.execute(undated.order_by(models.Task.id).limit(limit - len(tasks)))
+        tasks = [*tasks, *result.mappings().all()]
+    return tasks
 
-    result = (db.query(models.Task)
-              .filter(models.Task.id == task_id)
-              .update(task.model_dump(exclude={"user_id"}) | {"update_date": create_date}))
 
-    db.commit()
+async def get_tasks_version(db: AsyncSession,
+                            project_id: int,
+                            parent_task_id: int | None) -> Tuple[int, datetime | None]:
+    """
+    Возвращает количество задач списка и время последнего изменения среди них. Запрос покрывается
+    индексом по (project_id, parent_task_id), поэтому выполняется без чтения самих строк
+    """
+    result = await db.execute(
+        select(func.count(), func.max(func.coalesce(models.Task.update_date, models.Task.create_date)))
+        .filter(models.Task.project_id == project_id, models.Task.parent_task_id == parent_task_id)
+    )
+    return result.one()
 
-    if result == 1:
-        return update_dict, get_task(db, task_id)
-    return None, None
 
+async def get_task(db: AsyncSession,
+                   task_id: int) -> models.Task | None:
+    """
+    Возвращает информацию о конкретной задаче/подзадаче
+    """
+    result = await db.execute(select(models.Task).filter(models.Task.id == task_id).limit(1))
+    return result.scalars().one_or_none()
+
+
+async def get_tasks_by_ids(db: AsyncSession,
+                           ids: List[int]) -> List[RowMapping]:
+    """
+    Возвращает задачи с указанными идентификаторами одним запросом в виде строк со столбцами схемы Task.
+    Идентификаторы передаются одним параметром-массивом (id = ANY(...)), поэтому текст запроса
+    не зависит от их количества. Порядок строк не определен
+    """
+    result = await db.execute(
+        select(*task_columns).where(models.Task.id == any_(bindparam("ids", ids, type_=ARRAY(Integer))))
+    )
+    return result.mappings().all()
 
-def partial_update_task(db: Session,
+
+async def get_task_tree(db: AsyncSession,
                         task_id: int,
-                        create_date: datetime,
-                        task: schemas.TaskPartialUpdate) -> Tuple[dict | None, models.Task | None]:
+                        max_depth: int | None) -> List[Row]:
+    """
+    Возвращает задачу и все её подзадачи одним рекурсивным запросом, упорядоченные по глубине вложенности,
+    в виде строк со столбцами схемы Task. Столбцы задач выбираются внутри рекурсии по индексам, без
+    повторного соединения результата с таблицей: размер дерева планировщик оценивает с большим запасом
+    и для такого соединения выбрал бы полный просмотр tasks.
+    parent_task_id не ограничен внешним ключом, поэтому запрос хранит путь от корня и не заходит
+    в уже пройденные задачи: цикл в ссылках на родителей не зацикливает рекурсию
+    """
+    tree = (select(*task_columns, literal(0).label("depth"), array([models.Task.id]).label("path"))
+            .where(models.Task.id == task_id)
+            .cte("task_tree", recursive=True))
+    children = (select(*task_columns,
+                       (tree.c.depth + 1).label("depth"),
+                       func.array_append(tree.c.path, models.Task.id).label("path"))
+                .join(tree, models.Task.parent_task_id == tree.c.id)
+                .where(models.Task.id != all_(tree.c.path)))
+    if max_depth is not None:
+        children = children.where(tree.c.depth < max_depth)
+    tree = tree.union_all(children)
+
+    result = await db.execute(select(*(tree.c[column.key] for column in task_columns))
+                              .order_by(tree.c.depth, tree.c.create_date, tree.c.id))
+    return result.all()
+
+
+async def update_task(db: AsyncSession,
+                      task_id: int,
+                      create_date: datetime,
+                      task: schemas.TaskUpdate,
+                      if_match: List[int] | None = None) -> Tuple[dict | None, models.Task | None]:
+    """
+    Обновляет информацию о задаче/подзадаче
+    """
+    return await apply_task_update(
+        db, task_id, create_date, task.user_id, task.model_dump(exclude={"user_id"}), if_match
+    )
+
+
+async def partial_update_task(db: AsyncSession,
+                              task_id: int,
+                              create_date: datetime,
+                              task: schemas.TaskPartialUpdate,
+                              if_match: List[int] | None = None) -> Tuple[dict | None, models.Task | None]:
     """
     Обновляет частично информацию о задаче/подзадаче
     """
-    current_task = get_task(db, task_id)
-    update_dict = {}
+    return await apply_task_update(
+        db, task_id, create_date, task.user_id, task.model_dump(exclude_unset=True, exclude={"user_id"}), if_match
+    )
 
-    if not current_task:
-        return update_dict, None
 
-    for field, value in task.model_dump(exclude_unset=True, exclude={"user_id"}).items():
-        current_value = getattr(current_task, field)
-        if current_value != value:
-            update_dict[field] = current_value, value
+async def apply_task_update(db: AsyncSession,
+                            task_id: int,
+                            create_date: datetime,
+                            user_id: uuid.UUID,
+                            values: dict,
+                            if_match: List[int] | None = None) -> Tuple[dict | None, models.Task | None]:
+    """
+    Записывает изменения одним UPDATE ... FROM без блокировок: соединение таблицы с самой собой
+    возвращает в RETURNING прежние значения для системных комментариев, а условие на version
+    отбрасывает обновление, если задачу успели изменить. Если передан if_match, версия задачи должна
+    быть одной из указанных, иначе выбрасывается VersionConflict. Без if_match обновление
+    параллельно измененной задачи повторяется с ее новыми значениями, но не более MAX_UPDATE_ATTEMPTS раз,
+    затем выбрасывается UpdateConflict. Если значения не изменились, UPDATE не изменяет строку
+    """
+    values = normalize_update_values(values)
+    old = models.Task.__table__.alias("old")
+    criteria = [models.Task.id == task_id, old.c.id == models.Task.id, models.Task.version == old.c.version]
+    if if_match is not None:
+        criteria.append(models.Task.version.in_(if_match))
+    changed = [getattr(models.Task, field).is_distinct_from(value) for field, value in values.items()]
+
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        row = None
+        if changed:
+            row = (await db.execute(
+                update(models.Task)
+                .where(*criteria, or_(*changed))
+                .values(values | {"update_date": create_date, "version": models.Task.version + 1})
+                .returning(models.Task, *(old.c[field].label(f"old_{field}") for field in task_update_fields))
+                .execution_options(populate_existing=True, synchronize_session=False)
+            )).one_or_none()
+        if row is not None:
+            break
 
-    result = (db.query(models.Task)
-              .filter(models.Task.id == task_id)
-              .update(task.model_dump(exclude_unset=True, exclude={"user_id"}) | {"update_date": create_date}))
+        # Строка не обновлена: задачи нет, версия не совпала или значения не изменились
+        await db.rollback()
+        current_task = await get_task(db, task_id)
+        if current_task is None:
+            return {}, None
+        if if_match is not None and current_task.version not in if_match:
+            raise VersionConflict(current_task.version)
+        if all(getattr(current_task, field) == value for field, value in values.items()):
+            return {}, current_task
+    else:
+        raise UpdateConflict()
 
-    db.commit()
+    current_task, *old_values = row
+    old_values = dict(zip(task_update_fields, old_values))
+    update_dict = {
+        field: (old_values[field], value) for field, value in values.items() if old_values[field] != value
+    }
+    await crud_comments.create_system_comments(
+        db=db, task_id=task_id, user_id=user_id, create_date=create_date, update_dict=update_dict
+    )
+    old_stats_key = crud_stats.stats_key(
+        current_task.project_id, old_values["executor_id"], old_values["completion_date"]
+    )
+    new_stats_key = crud_stats.stats_key(
+        current_task.project_id, current_task.executor_id, current_task.completion_date
+    )
+    if new_stats_key != old_stats_key:
+        await crud_stats.apply_stats_delta(db, Counter({old_stats_key: -1, new_stats_key: 1}))
+    await events.publish(db, "task", "updated", task_id, task_id, current_task.project_id)
 
-    if result == 1:
-        return update_dict, get_task(db, task_id)
-    return None, None
+    await db.commit()
+    return update_dict, current_task
 
 
-def delete_task(db: Session,
-                task_id: int) -> tuple[models.Task, List[str]] | tuple[None, None]:
+async def delete_task(db: AsyncSession,
+                      task_id: int) -> tuple[RowMapping, List[str], List[str]] | tuple[None, None, None]:
     """
-    Удаляет информацию о задаче/подзадаче
+    Удаляет задачу/подзадачу вместе со всем деревом ее подзадач. Вложения дерева удаляются одним
+    DELETE ... RETURNING, задачи - вторым, комментарии удаляются каскадно. Возвращает удаленную задачу,
+    пути файлов вложений, сохраненных вне хранилища блобов, которые нужно удалить с диска, и хэши
+    блобов, на которые могло не остаться ссылок (их удаляет delete_unreferenced_blobs).
+    Дерево собирается через UNION, который отбрасывает уже найденные задачи, поэтому цикл в ссылках
+    на родителей не зацикливает рекурсию. Идентификаторы дерева выбираются один раз с блокировкой
+    строк (FOR UPDATE) и передаются в оба DELETE одним массивом: вложение, добавленное к задаче дерева
+    или к подзадаче, созданной между запросами, не удалится каскадом без учета ссылок на блоб.
+    Подзадача, созданная после выборки дерева, не удаляется
     """
-    deleted_task = get_task(db, task_id)
-    file_paths = []
-    if deleted_task:
-        for document in deleted_task.documents:
-            file_paths.append(document.file_path)
+    tree = (select(models.Task.id)
+            .where(models.Task.id == task_id)
+            .cte("task_tree", recursive=True))
+    tree = tree.union(select(models.Task.id).join(tree, models.Task.parent_task_id == tree.c.id))
+    # Дерево подставляется массивом (= ANY(ARRAY(...))): его размер планировщик оценивает с большим
+    # запасом и для соединения с ним выбрал бы полный просмотр tasks
+    ids = (await db.execute(
+        select(models.Task.id)
+        .where(models.Task.id == any_(func.array(select(tree.c.id).scalar_subquery(), type_=ARRAY(Integer))))
+        .with_for_update()
+    )).scalars().all()
+    if not ids:
+        await db.rollback()
+        return None, None, None
+    tree_ids = bindparam("tree_ids", ids, type_=ARRAY(Integer))
+
+    file_paths, blobs = await crud_documents.delete_documents(db, models.TaskDocument.task_id == any_(tree_ids))
+    deleted = (await db.execute(
+        delete(models.Task)
+        .where(models.Task.id == any_(tree_ids))
+        .returning(*task_columns)
+        .execution_options(synchronize_session=False)
+    )).mappings().all()
 
-    result = (db.query(models.Task)
-              .filter(models.Task.id == task_id)
-              .delete())
+    deleted_task = next((task for task in deleted if task["id"] == task_id), None)
+    if deleted_task is not None:
+        delta = Counter()
+        delta.subtract(
+            crud_stats.stats_key(task["project_id"], task["executor_id"], task["completion_date"]) for task in deleted
+        )
+        await crud_stats.apply_stats_delta(db, delta)
+        await events.publish(db, "task", "deleted", task_id, task_id, deleted_task["project_id"])
 
-    db.commit()
+    await db.commit()
 
-    if result == 1:
-        return deleted_task, file_paths
-    return None, None
+    if deleted_task is not None:
+        return deleted_task, file_paths, blobs
+    return None, None, None
@@ -1,16 +1,100 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase
+
+from .pool import MeteredQueuePool
 
 
 class DatabaseInitializer:
-    def __init__(self, base) -> None:
+    def __init__(self, base: DeclarativeBase) -> None:
         self.base = base
+        self.__engine = None
+        self.__async_session_maker = None
+
+    async def init_database(self,
+                            postgres_dsn,
+                            pool_size: int = 5,
+                            max_overflow: int = 10,
+                            pool_timeout: float = 30,
+                            pool_recycle: int = -1,
+                            pool_pre_ping: bool = False,
+                            statement_timeout: int = 0):
+        connect_args = {}
+        if statement_timeout:
+            connect_args["server_settings"] = {"statement_timeout": str(statement_timeout)}
+        self.__engine = create_async_engine(
+            postgres_dsn,
+            poolclass=MeteredQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping,
+            connect_args=connect_args
+        )
+        self.__async_session_maker = async_sessionmaker(
+            self.__engine, autoflush=False, expire_on_commit=False
+        )
+        async with self.__engine.begin() as conn:
+            await conn.run_sync(self.create_schema)
+
+    def create_schema(self, conn):
+        """
+        Создает новые таблицы вместе с их индексами и добавляет в существующие таблицы столбцы,
+        добавление которых не перезаписывает таблицу. Вычисляемые столбцы и индексы существующих
+        таблиц добавляет команда python -m app.migrate_schema
+        """
+        self.base.metadata.create_all(bind=conn)
+        self.add_missing_columns(conn)
+
+    def missing_columns(self, conn, computed: bool) -> list:
+        """
+        Возвращает объявленные в моделях столбцы, которых еще нет в существующих таблицах:
+        хранимые вычисляемые, если computed, иначе остальные. Добавление хранимого вычисляемого
+        столбца перезаписывает всю таблицу под исключительной блокировкой
+        """
+        inspector = inspect(conn)
+        columns = []
+        for table in self.base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or (column.computed is not None) != computed:
+                    continue
+                if column.nullable or column.server_default is not None or column.computed is not None:
+                    columns.append(column)
+        return columns
+
+    def add_missing_columns(self, conn):
+        """
+        Добавляет в существующие таблицы объявленные в моделях столбцы, которых в них еще нет.
+        create_all создает только новые таблицы, а схема пополняется столбцами, допускающими NULL
+        или имеющими значение по умолчанию. Хранимые вычисляемые столбцы не добавляются
+        """
+        for column in self.missing_columns(conn, computed=False):
+            self.add_column(conn, column)
+
+    @staticmethod
+    def add_column(conn, column):
+        column_spec = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE "{column.table.name}" ADD COLUMN IF NOT EXISTS {column_spec}'))
+
+    def pool_stats(self) -> dict:
+        return self.__engine.pool.stats()
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    def driver_connect_args(self) -> dict:
+        """
+        Возвращает параметры подключения драйвера для отдельных соединений вне пула
+        """
+        return self.__engine.dialect.create_connect_args(self.__engine.url)[1]
 
-    def init_database(self, postgres_dsn):
-        engine = create_engine(postgres_dsn)
-        session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        self.base.metadata.create_all(bind=engine)
-        return session_local
+    @property
+    def async_session_maker(self):
+        return self.__async_session_maker
 
 
 class Base(DeclarativeBase):
@@ -1,13 +1,26 @@
 import uuid
 
-from sqlalchemy import Column, Integer, String, Text, UUID, DateTime, ForeignKey
-from sqlalchemy.orm import mapped_column, relationship
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import (Column, Computed, Integer, BigInteger, String, Text, UUID, Date, DateTime, ForeignKey, Index,
+                        LargeBinary, text)
+from sqlalchemy.orm import deferred, mapped_column, relationship
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from .database import Base
 
+# Конфигурация полнотекстового поиска, которой строятся поисковые векторы и запросы
+SEARCH_CONFIG = "russian"
+
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_project_id_parent_task_id_create_date_id",
+              "project_id", "parent_task_id", "create_date", "id",
+              postgresql_include=["update_date"]),
+        Index("ix_tasks_parent_task_id", "parent_task_id"),
+        Index("ix_tasks_executor_id_completion_date_id", "executor_id", "completion_date", "id",
+              postgresql_where=text("executor_id IS NOT NULL")),
+        Index("ix_tasks_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
@@ -19,18 +32,35 @@ class Task(Base):
     create_date = Column(DateTime(timezone=True))
     update_date = Column(DateTime(timezone=True))
     completion_date = Column(DateTime(timezone=True))
+    version = Column(Integer, nullable=False, server_default=text("1"))
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')",
+        persisted=True
+    )))
     comments = relationship("Comment", backref='task')
     documents = relationship("TaskDocument", backref='task')
 
 
 class Comment(Base):
     __tablename__ = "comment"
+    __table_args__ = (
+        Index("ix_comment_task_id_create_date", "task_id", "create_date", postgresql_include=["update_date"]),
+        Index("ix_comment_search_vector", "search_vector",
+              postgresql_using="gin", postgresql_where=text("type_id = 4")),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     user_id = Column(UUID(as_uuid=True), nullable=False)
     data = Column(JSONB)
     create_date = Column(DateTime(timezone=True))
+    update_date = Column(DateTime(timezone=True))
     type_id = mapped_column(ForeignKey("comment_type.id"))
+    # Вектор строится только для пользовательских комментариев, у системных он NULL
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        f"CASE WHEN type_id = 4 THEN to_tsvector('{SEARCH_CONFIG}', coalesce(data ->> 'message', '')) END",
+        persisted=True
+    )))
     type = relationship("CommentType")
     task_id = mapped_column(ForeignKey("tasks.id", ondelete='CASCADE'), nullable=False)
     documents = relationship("TaskDocument", backref='comment')
@@ -44,12 +74,57 @@ class CommentType(Base):
 
 class TaskDocument(Base):
     __tablename__ = "task_document"
+    __table_args__ = (
+        Index("ix_task_document_task_id_comment_id_create_date", "task_id", "comment_id", "create_date"),
+        Index("ix_task_document_comment_id", "comment_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(UUID(as_uuid=True), nullable=False)
     name = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
+    size = Column(BigInteger)
+    sha256 = Column(String(64))
     create_date = Column(DateTime(timezone=True))
     task_id = mapped_column(ForeignKey("tasks.id", ondelete='CASCADE'), nullable=False)
     comment_id = mapped_column(ForeignKey("comment.id", ondelete='CASCADE'))
 
 
+class DocumentBlob(Base):
+    __tablename__ = "document_blob"
+    sha256 = Column(String(64), primary_key=True)
+    file_path = Column(String, nullable=False, unique=True)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False)
+    create_date = Column(DateTime(timezone=True))
+
+
+class TaskStats(Base):
+    """
+    Количество задач проекта в разрезе исполнителя и дня срока выполнения. Поддерживается
+    операциями записи задач, задачи без исполнителя и без срока учитываются под
+    значениями crud_stats.NO_EXECUTOR и crud_stats.NO_DUE_DATE
+    """
+    __tablename__ = "task_stats"
+    project_id = Column(Integer, primary_key=True)
+    executor_id = Column(UUID(as_uuid=True), primary_key=True)
+    due_date = Column(Date, primary_key=True)
+    task_count = Column(Integer, nullable=False)
+
+
+class IdempotencyKey(Base):
+    """
+    Ключ идемпотентности запроса и сохраненный ответ на него. Пока запрос выполняется,
+    status_code пуст, повторные запросы с тем же ключом ждут его завершения
+    """
+    __tablename__ = "idempotency_key"
+    __table_args__ = (
+        Index("ix_idempotency_key_create_date", "create_date"),
+    )
+    key = Column(String(255), primary_key=True)
+    request = Column(String, nullable=False)
+    # Хэш SHA-256 заголовка Authorization и тела запроса
+    fingerprint = Column(String(64))
+    status_code = Column(Integer)
+    content_type = Column(String)
+    body = Column(LargeBinary)
+    create_date = Column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,57 @@
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, который дополнительно учитывает время ожидания свободного соединения
+    и количество отказов по таймауту
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            wait_time = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def stats(self) -> dict:
+        """
+        Возвращает текущее состояние пула и накопленные с момента запуска показатели ожидания
+        """
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_max": self.wait_time_max
+        }
+
+
+def is_pool_saturated(stats: dict) -> bool:
+    """
+    Проверяет по показателям stats(), выданы ли все соединения пула. Отрицательный max_overflow
+    означает неограниченное число дополнительных соединений, и такой пул не исчерпывается
+    """
+    if stats["max_overflow"] < 0:
+        return False
+    return stats["checked_out"] >= stats["size"] + stats["max_overflow"]
@@ -0,0 +1,138 @@
+import asyncio
+import json
+from typing import Any, Set
+
+import asyncpg
+from sqlalchemy import String, cast, func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import models
+
+# Канал PostgreSQL, через который операции записи публикуют события об изменениях
+CHANNEL = "task_events"
+
+
+async def publish(db: AsyncSession,
+                  entity: str,
+                  action: str,
+                  task_id: int | None,
+                  item_id: Any = None,
+                  project_id: int | None = None) -> None:
+    """
+    Публикует событие об изменении через pg_notify в текущей транзакции: подписчики получат его
+    только после фиксации. Если project_id не передан, он берется из задачи task_id.
+    Транзакция не фиксируется
+    """
+    if project_id is None:
+        project_id = select(models.Task.project_id).where(models.Task.id == task_id).scalar_subquery()
+    payload = func.json_build_object(
+        "entity", entity,
+        "action", action,
+        "id", cast(literal(None if item_id is None else str(item_id)), String),
+        "task_id", task_id,
+        "project_id", project_id
+    )
+    await db.execute(select(func.pg_notify(CHANNEL, cast(payload, String))))
+
+
+class Subscription:
+    """
+    Подписка клиента на события проекта и/или задачи. Если клиент не успевает забирать события
+    и очередь переполняется, подписка закрывается: клиент должен переподключиться и перечитать данные
+    """
+
+    def __init__(self, project_id: int | None, task_id: int | None, queue_size: int) -> None:
+        self.project_id = project_id
+        self.task_id = task_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+
+    def matches(self, event: dict) -> bool:
+        if self.project_id is not None and event.get("project_id") != self.project_id:
+            return False
+        if self.task_id is not None and event.get("task_id") != self.task_id:
+            return False
+        return True
+
+    def offer(self, event: dict, payload: str) -> None:
+        if self.closed or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Закрывает подписку: в очередь помещается None, по которому потребитель завершает отправку
+        """
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self) -> str | None:
+        return await self.queue.get()
+
+
+class EventHub:
+    """
+    Слушает канал событий одним соединением на процесс и раздает события подписчикам.
+    При потере соединения переподключается; события, отправленные за время переподключения, теряются
+    """
+
+    def __init__(self) -> None:
+        self.subscriptions: Set[Subscription] = set()
+        self.connect_args = {}
+        self.queue_size = 100
+        self.keepalive_interval = 30
+        self.task = None
+
+    async def start(self, connect_args: dict, queue_size: int) -> None:
+        self.connect_args = connect_args
+        self.queue_size = queue_size
+        self.task = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        for subscription in list(self.subscriptions):
+            subscription.close()
+
+    def subscribe(self, project_id: int | None, task_id: int | None) -> Subscription:
+        subscription = Subscription(project_id, task_id, self.queue_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+
+    async def listen(self) -> None:
+        while True:
+            try:
+                connection = await asyncpg.connect(**self.connect_args)
+                try:
+                    await connection.add_listener(CHANNEL, self.dispatch)
+                    # Периодический запрос обнаруживает оборванное соединение
+                    while not connection.is_closed():
+                        await asyncio.sleep(self.keepalive_interval)
+                        await connection.fetchval("SELECT 1")
+                finally:
+                    await connection.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Соединение для получения событий потеряно: {e!r}")
+            await asyncio.sleep(1)
+
+    def dispatch(self, connection, pid: int, channel: str, payload: str) -> None:
+        event = json.loads(payload)
+        for subscription in list(self.subscriptions):
+            subscription.offer(event, payload)
+
+
+event_hub = EventHub()
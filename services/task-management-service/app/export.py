@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Tuple
+
+from sqlalchemy.engine import RowMapping
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+media_types = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv; charset=utf-8"
+}
+
+# Общий набор колонок CSV для задач, комментариев и вложений, entity указывает тип строки
+csv_columns = [
+    "entity", "id", "task_id", "parent_task_id", "comment_id", "type_id", "name", "description",
+    "creator_id", "executor_id", "user_id", "data", "size", "sha256",
+    "create_date", "update_date", "completion_date"
+]
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    """
+    Проверяет, что клиент принимает ответ, сжатый gzip, по заголовку Accept-Encoding
+    """
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            quality = params.strip().removeprefix("q=")
+            try:
+                return not params or float(quality) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def json_default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+async def encode_ndjson(rows: AsyncIterator[Tuple[str, RowMapping]]) -> AsyncIterator[str]:
+    async for entity, row in rows:
+        yield json.dumps({"entity": entity, **row}, default=json_default, ensure_ascii=False) + "\n"
+
+
+async def encode_csv(rows: AsyncIterator[Tuple[str, RowMapping]]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(csv_columns)
+    async for entity, row in rows:
+        writer.writerow([entity] + [csv_value(row.get(column)) for column in csv_columns[1:]])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def encode(rows: AsyncIterator[Tuple[str, RowMapping]],
+                 export_format: ExportFormat,
+                 compress: bool,
+                 chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """
+    Кодирует строки выгрузки в NDJSON или CSV и отдает их блоками около chunk_size байт,
+    при необходимости сжимая gzip на лету
+    """
+    lines = encode_ndjson(rows) if export_format == ExportFormat.ndjson else encode_csv(rows)
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    chunk = bytearray()
+    async for line in lines:
+        chunk += line.encode()
+        if len(chunk) >= chunk_size:
+            yield compressor.compress(bytes(chunk)) if compressor else bytes(chunk)
+            chunk.clear()
+    if compressor:
+        yield compressor.compress(bytes(chunk)) + compressor.flush()
+    elif chunk:
+        yield bytes(chunk)
@@ -0,0 +1,211 @@
+import asyncio
+import email.message
+import hashlib
+import tempfile
+from typing import Collection
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .database import DB_INITIALIZER
+from . import crud_idempotency, responses, storage, upload_limit
+
+HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+# Интервал удаления устаревших ключей, секунд
+SWEEP_INTERVAL = 600
+# Тело запроса до этого размера хранится в памяти, больше - во временном файле
+SPOOL_MAX_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Наибольший интервал опроса БД при ожидании первого запроса с тем же ключом, секунд
+MAX_POLL_INTERVAL = 2.0
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI-middleware для POST-запросов с заголовком Idempotency-Key к путям paths. Первый запрос
+    с ключом выполняется, и его ответ (кроме ответов 5xx) сохраняется в БД. Повторные запросы
+    с тем же ключом получают сохраненный ответ, не выполняя обработчик. Если первый запрос еще
+    выполняется, повторные ждут его завершения не дольше wait_timeout секунд, затем получают 409;
+    интервал опроса БД начинается с poll_interval и удваивается до MAX_POLL_INTERVAL.
+    С ключом сохраняется хэш тела запроса и заголовка Authorization: запрос с тем же ключом,
+    но другим телом, путем или отправителем получает 422
+    """
+
+    def __init__(self, app: ASGIApp, paths: Collection[str], wait_timeout: float, poll_interval: float = 0.1) -> None:
+        self.app = app
+        self.paths = paths
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get(HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            response = responses.FastJSONResponse(
+                {"detail": f"Ключ идемпотентности должен содержать от 1 до {MAX_KEY_LENGTH} символов"},
+                status_code=400
+            )
+            await response(scope, receive, send)
+            return
+
+        request = f"{scope['method']} {scope['path']}"
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            try:
+                fingerprint = await read_body(scope, receive, spool)
+            except upload_limit.UploadTooLarge:
+                # Ключ еще не занят, запрос отклоняется так же, как без заголовка
+                await upload_limit.UploadSizeLimitMiddleware.reject(scope, receive, send)
+                return
+            if fingerprint is None:
+                # Клиент отключился, не дослав тело запроса
+                return
+            await self.handle(key, request, fingerprint, scope, replay_body(spool, receive), send)
+
+    async def handle(self,
+                     key: str,
+                     request: str,
+                     fingerprint: str,
+                     scope: Scope,
+                     receive: Receive,
+                     send: Send) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        poll_interval = self.poll_interval
+        while True:
+            async with DB_INITIALIZER.async_session_maker() as db:
+                acquired, stored = await crud_idempotency.acquire_key(db, key, request, fingerprint)
+            if acquired:
+                await self.run(key, scope, receive, send)
+                return
+            if stored is None:
+                # Первый запрос завершился ошибкой и освободил ключ
+                continue
+            if stored.request != request or stored.fingerprint not in (None, fingerprint):
+                response = responses.FastJSONResponse(
+                    {"detail": "Ключ идемпотентности уже использован для другого запроса"}, status_code=422
+                )
+                break
+            if stored.status_code is not None:
+                response = Response(
+                    content=stored.body,
+                    status_code=stored.status_code,
+                    media_type=stored.content_type,
+                    headers={"idempotent-replayed": "true"}
+                )
+                break
+            if loop.time() >= deadline:
+                response = responses.FastJSONResponse(
+                    {"detail": "Запрос с этим ключом идемпотентности еще выполняется"}, status_code=409
+                )
+                break
+            await asyncio.sleep(min(poll_interval, deadline - loop.time()))
+            poll_interval = min(poll_interval * 2, MAX_POLL_INTERVAL)
+        await response(scope, receive, send)
+
+    async def run(self, key: str, scope: Scope, receive: Receive, send: Send) -> None:
+        """
+        Выполняет запрос, передавая ответ клиенту и одновременно собирая его для сохранения
+        """
+        start = {}
+        body = []
+
+        async def send_and_capture(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                body.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_capture)
+        except BaseException:
+            async with DB_INITIALIZER.async_session_maker() as db:
+                await crud_idempotency.release_key(db, key)
+            raise
+
+        async with DB_INITIALIZER.async_session_maker() as db:
+            if start.get("status", 500) < 500:
+                content_type = Headers(raw=start.get("headers", [])).get("content-type")
+                await crud_idempotency.complete_key(db, key, start["status"], content_type, b"".join(body))
+            else:
+                await crud_idempotency.release_key(db, key)
+
+
+async def read_body(scope: Scope, receive: Receive, spool) -> str | None:
+    """
+    Читает тело запроса в spool и возвращает хэш SHA-256 заголовка Authorization и тела.
+    Граница multipart-запроса в хэш не входит: клиенты выбирают ее заново при каждом повторе.
+    Запись в spool выполняется в пуле файловых операций: большое тело хранится на диске.
+    Возвращает None, если клиент отключился
+    """
+    headers = Headers(scope=scope)
+    digest = hashlib.sha256(headers.get("authorization", "").encode())
+    digest.update(b"\0")
+    boundary = multipart_boundary(headers.get("content-type", ""))
+    # Хвост, в котором может начинаться граница, хэшируется вместе со следующей частью тела
+    tail = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body = message.get("body", b"")
+        await storage.file_io.run(spool.write, body)
+        more_body = message.get("more_body", False)
+        if boundary:
+            data = (tail + body).replace(boundary, b"")
+            split = max(len(data) - len(boundary) + 1, 0)
+            data, tail = data[:split], data[split:]
+        else:
+            data = body
+        digest.update(data)
+    digest.update(tail)
+    spool.seek(0)
+    return digest.hexdigest()
+
+
+def multipart_boundary(content_type: str) -> bytes | None:
+    message = email.message.Message()
+    message["content-type"] = content_type
+    boundary = message.get_param("boundary") if message.get_content_type() == "multipart/form-data" else None
+    return boundary.encode("latin-1") if isinstance(boundary, str) and boundary else None
+
+
+def replay_body(spool, receive: Receive) -> Receive:
+    """
+    Возвращает receive, который отдает приложению прочитанное тело из spool, а затем
+    передает сообщения исходного receive (например, об отключении клиента)
+    """
+    size = spool.seek(0, 2)
+    spool.seek(0)
+    replayed = False
+
+    async def receive_replayed() -> Message:
+        nonlocal replayed
+        if replayed:
+            return await receive()
+        chunk = await storage.file_io.run(spool.read, CHUNK_SIZE)
+        replayed = spool.tell() >= size
+        return {"type": "http.request", "body": chunk, "more_body": not replayed}
+
+    return receive_replayed
+
+
+async def sweep_periodically(ttl: float, pending_timeout: float) -> None:
+    """
+    Периодически удаляет устаревшие ключи идемпотентности
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            async with DB_INITIALIZER.async_session_maker() as db:
+                await crud_idempotency.delete_expired_keys(db, ttl, pending_timeout)
+        except Exception as e:
+            print(f"Не удалось удалить устаревшие ключи идемпотентности: {e!r}")
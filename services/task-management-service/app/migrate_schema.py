@@ -0,0 +1,65 @@
+"""
+Доводит схему существующей БД до моделей: добавляет хранимые вычисляемые столбцы (search_vector)
+и недостающие индексы. При старте сервис только создает новые таблицы и добавляет столбцы,
+не требующие перезаписи таблицы, поэтому после обновления команду нужно выполнить до запуска
+или во время работы сервиса.
+
+Запуск: python -m app.migrate_schema
+
+Вычисляемый столбец добавляется отдельной транзакцией и перезаписывает таблицу под исключительной
+блокировкой, поэтому для больших таблиц команду следует запускать в окно обслуживания. Индексы
+строятся через CREATE INDEX CONCURRENTLY, не блокируя запись; индекс, оставшийся невалидным после
+прерванного построения, удаляется и строится заново, поэтому команду можно просто запустить повторно
+"""
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from .database import DB_INITIALIZER
+from . import config
+
+
+async def add_computed_columns() -> None:
+    async with DB_INITIALIZER.engine.connect() as conn:
+        columns = await conn.run_sync(DB_INITIALIZER.missing_columns, computed=True)
+    for column in columns:
+        print(f"Добавление столбца {column.table.name}.{column.name} (перезапись таблицы)")
+        async with DB_INITIALIZER.engine.begin() as conn:
+            await conn.run_sync(DB_INITIALIZER.add_column, column)
+
+
+async def create_indexes() -> None:
+    engine = DB_INITIALIZER.engine.execution_options(isolation_level="AUTOCOMMIT")
+    async with engine.connect() as conn:
+        existing = dict((await conn.execute(text(
+            "SELECT c.relname, i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = current_schema()"
+        ))).all())
+        for table in DB_INITIALIZER.base.metadata.sorted_tables:
+            for index in table.indexes:
+                if existing.get(index.name):
+                    continue
+                index.dialect_options["postgresql"]["concurrently"] = True
+                if index.name in existing:
+                    print(f"Удаление невалидного индекса {index.name}")
+                    await conn.execute(DropIndex(index))
+                print(f"Построение индекса {index.name}")
+                await conn.execute(CreateIndex(index))
+
+
+async def migrate() -> None:
+    cfg = config.load_config()
+    await DB_INITIALIZER.init_database(cfg.postgres_dsn_async.unicode_string())
+    await add_computed_columns()
+    await create_indexes()
+
+
+def main():
+    asyncio.run(migrate())
+
+
+if __name__ == "__main__":
+    main()
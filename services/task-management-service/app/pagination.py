@@ -0,0 +1,48 @@
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+
+def encode_cursor(key_date: datetime | None, item_id: int) -> str:
+    """
+    Кодирует ключ последней записи страницы в непрозрачный курсор
+    """
+    payload = json.dumps([key_date.isoformat() if key_date else None, item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, nullable_date: bool = False) -> Tuple[datetime | None, int]:
+    """
+    Восстанавливает ключ (дата, id) из курсора, при ошибке выбрасывает ValueError.
+    Пустая дата допускается, только если nullable_date: в остальных списках ключ сравнивается
+    с датой, и курсор с NULL вернул бы пустую страницу
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key_date, item_id = json.loads(base64.urlsafe_b64decode(padded))
+        if key_date is None and not nullable_date:
+            raise ValueError("Курсор без даты")
+        return datetime.fromisoformat(key_date) if key_date is not None else None, int(item_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError("Некорректный курсор") from e
+
+
+def encode_search_cursor(rank: float, entity: str, item_id: str) -> str:
+    """
+    Кодирует ключ (rank, entity, id) последнего результата поиска в непрозрачный курсор
+    """
+    payload = json.dumps([rank, entity, item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, str, str]:
+    """
+    Восстанавливает ключ (rank, entity, id) из курсора поиска, при ошибке выбрасывает ValueError
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, entity, item_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(rank), str(entity), str(item_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError("Некорректный курсор") from e
@@ -0,0 +1,181 @@
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, List, Mapping, Tuple
+from urllib.parse import quote
+
+import anyio
+import orjson
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+
+class FastJSONResponse(Response):
+    """
+    JSON-ответ, который кодирует готовые словари через orjson без валидации pydantic-моделями.
+    Время в UTC записывается с суффиксом Z, как и при сериализации pydantic, а UUID драйвера asyncpg,
+    которые orjson не распознает, приводятся к строке
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=str, option=orjson.OPT_UTC_Z)
+
+
+class FileRangeResponse(Response):
+    """
+    Ответ с содержимым файла или его диапазоном байт. Если ASGI-сервер поддерживает расширение
+    http.response.zerocopysend, файл передается через sendfile без копирования в память процесса
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self,
+                 path: str,
+                 offset: int,
+                 length: int,
+                 status_code: int,
+                 headers: Mapping[str, str],
+                 media_type: str) -> None:
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.headers["content-length"] = str(length)
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False
+                })
+        else:
+            async with await anyio.open_file(self.path, "rb") as file:
+                await file.seek(self.offset)
+                remaining = self.length
+                more_body = True
+                while more_body:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    remaining -= len(chunk)
+                    more_body = bool(chunk) and remaining > 0
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        if self.background is not None:
+            await self.background()
+
+
+def file_response(request: Request,
+                  path: str,
+                  etag: str,
+                  last_modified: datetime | None,
+                  media_type: str,
+                  filename: str) -> Response:
+    """
+    Формирует ответ на запрос содержимого файла с учетом If-None-Match/If-Modified-Since и Range/If-Range
+    """
+    size = os.stat(path).st_size
+    headers = {"etag": etag, "accept-ranges": "bytes"}
+    if last_modified is not None:
+        last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+        headers["last-modified"] = format_datetime(last_modified, usegmt=True)
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+    range_header = request.headers.get("range")
+    if range_header and if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            return FileRangeResponse(path, start, end - start + 1, 206, headers, media_type)
+    return FileRangeResponse(path, 0, size, 200, headers, media_type)
+
+
+def collection_etag(count: int, last_modified: datetime | None) -> str:
+    """
+    Формирует слабый ETag списка по количеству элементов и времени последнего изменения
+    """
+    timestamp = int(last_modified.timestamp() * 1_000_000) if last_modified else 0
+    return f'W/"{count}-{timestamp}"'
+
+
+def version_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def parse_if_match(request: Request) -> List[int] | None:
+    """
+    Возвращает версии из заголовка If-Match, или None, если заголовка нет или он равен "*".
+    If-Match сравнивает ETag строго, поэтому слабые и нечисловые ETag не совпадают ни с одной версией
+    """
+    if_match = request.headers.get("if-match")
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime | None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = parse_http_date(request.headers.get("if-modified-since"))
+    return last_modified is not None and if_modified_since is not None and last_modified <= if_modified_since
+
+
+def if_range_matches(request: Request, etag: str, last_modified: datetime | None) -> bool:
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if if_range.startswith('"'):
+        return not etag.startswith("W/") and if_range == etag
+    return last_modified is not None and parse_http_date(if_range) == last_modified
+
+
+def parse_range(range_header: str, size: int) -> Tuple[int, int] | None:
+    """
+    Разбирает заголовок Range с одним диапазоном. Возвращает None, если заголовок нужно
+    проигнорировать, и выбрасывает ValueError, если диапазон невыполним
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        if int(last) == 0 or size == 0:
+            raise ValueError("Range Not Satisfiable")
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Range Not Satisfiable")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def parse_http_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
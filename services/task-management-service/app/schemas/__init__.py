@@ -1,7 +1,13 @@
-from .task import TaskBase, Task, TaskCreate, TaskUpdate, TaskPartialUpdate
+from .task import (TaskBase, Task, TaskCreate, TaskBatchItem, TaskBatchResult, TaskBatchGet, TaskBatchGetResult,
+                   TaskUpdate, TaskPartialUpdate, TaskPage, TaskTree, ExecutorStats, ProjectStats)
 from .comment import Comment, UserCommentCreate, UserCommentUpdate, CommentTypeUpsert
 from .document import DocumentBase, Document, DocumentCreate
+from .health import PoolStatus, DatabaseHealth
+from .search import SearchHit, SearchPage
 
-__all__ = [TaskBase, Task, TaskCreate, TaskUpdate, TaskPartialUpdate,
+__all__ = [TaskBase, Task, TaskCreate, TaskBatchItem, TaskBatchResult, TaskBatchGet, TaskBatchGetResult,
+           TaskUpdate, TaskPartialUpdate, TaskPage, TaskTree, ExecutorStats, ProjectStats,
            Comment, UserCommentCreate, UserCommentUpdate, CommentTypeUpsert,
-           DocumentBase, Document, DocumentCreate]
+           DocumentBase, Document, DocumentCreate,
+           PoolStatus, DatabaseHealth,
+           SearchHit, SearchPage]
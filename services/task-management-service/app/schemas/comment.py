@@ -1,6 +1,7 @@
 import json
 import uuid
 from datetime import datetime
+from typing import Optional
 
 from pydantic import BaseModel, model_validator
 
@@ -18,6 +19,7 @@ class Comment(BaseModel):
     type_id: int
     task_id: int
     create_date: datetime
+    update_date: Optional[datetime] = None
     user_id: uuid.UUID
     data: dict
 
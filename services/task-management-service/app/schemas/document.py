@@ -19,6 +19,8 @@ class Document(DocumentBase):
     id: int
     name: str
     file_path: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
     create_date: datetime
 
 
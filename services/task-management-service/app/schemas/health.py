@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+
+
+class PoolStatus(BaseModel):
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    max_overflow: int
+    checkouts: int
+    timeouts: int
+    wait_time_total: float
+    wait_time_max: float
+
+
+class DatabaseHealth(BaseModel):
+    status: str
+    pool: PoolStatus
@@ -0,0 +1,23 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class SearchHit(BaseModel):
+    """
+    Результат поиска: задача или пользовательский комментарий к ней
+    """
+    entity: str
+    id: str
+    task_id: int
+    task_name: str
+    message: Optional[str] = None
+    rank: float
+
+
+class SearchPage(BaseModel):
+    """
+    Страница результатов поиска с курсором на следующую страницу
+    """
+    items: List[SearchHit]
+    next_cursor: Optional[str] = None
@@ -2,8 +2,8 @@ import json
 import uuid
 from datetime import datetime
 
-from pydantic import BaseModel, model_validator
-from typing import Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, List
 
 
 class TaskBase(BaseModel):
@@ -29,6 +29,7 @@ class Task(TaskBase):
     creator_id: uuid.UUID
     create_date: datetime
     update_date: Optional[datetime] = None
+    version: int
     name: str
 
 
@@ -49,6 +50,37 @@ class TaskCreate(TaskBase):
         return value
 
 
+class TaskBatchItem(TaskCreate):
+    """
+    Модель задачи в пакете для добавления. temp_id задает клиент, чтобы ссылаться
+    на задачу пакета как на родительскую через parent_temp_id
+    """
+    temp_id: Optional[str] = None
+    parent_temp_id: Optional[str] = None
+
+
+class TaskBatchResult(BaseModel):
+    """
+    Идентификаторы добавленных задач в порядке их следования в пакете
+    """
+    ids: List[int]
+
+
+class TaskBatchGet(BaseModel):
+    """
+    Идентификаторы задач для получения одним запросом
+    """
+    ids: List[int] = Field(min_length=1, max_length=1000)
+
+
+class TaskBatchGetResult(BaseModel):
+    """
+    Найденные задачи в порядке запроса и идентификаторы задач, которые не найдены
+    """
+    items: List[Task]
+    missing: List[int]
+
+
 class TaskUpdate(TaskBase):
     """
     Модель для обновления задачи
@@ -62,3 +94,37 @@ class TaskPartialUpdate(TaskBase):
     Модель для частичного обновления задачи
     """
     user_id: uuid.UUID
+
+
+class TaskPage(BaseModel):
+    """
+    Страница списка задач с курсором на следующую страницу
+    """
+    items: List[Task]
+    next_cursor: Optional[str] = None
+
+
+class TaskTree(Task):
+    """
+    Модель задачи с вложенным деревом подзадач
+    """
+    subtasks: List["TaskTree"] = []
+
+
+class ExecutorStats(BaseModel):
+    """
+    Нагрузка исполнителя: количество задач и просроченных задач. executor_id пуст для задач без исполнителя
+    """
+    executor_id: Optional[uuid.UUID] = None
+    task_count: int
+    overdue_count: int
+
+
+class ProjectStats(BaseModel):
+    """
+    Сводная статистика задач проекта
+    """
+    project_id: int
+    task_count: int
+    overdue_count: int
+    executors: List[ExecutorStats]
@@ -0,0 +1,75 @@
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import responses
+
+DETAIL = "Размер загружаемых файлов превышает допустимый"
+
+
+class UploadTooLarge(HTTPException):
+    """
+    Тело запроса превысило лимит. Наследуется от HTTPException, чтобы FastAPI не заменял его
+    ошибкой разбора формы (400), а ExceptionMiddleware отвечал 413, если тело читает обработчик
+    """
+
+    def __init__(self) -> None:
+        super().__init__(status_code=413, detail=DETAIL)
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI-middleware, ограничивающее размер тела multipart-запросов max_size байтами до разбора формы.
+    Запрос с большим Content-Length отклоняется с 413 сразу, без чтения тела. Иначе считаются
+    полученные байты тела, и при превышении лимита чтение прерывается исключением UploadTooLarge,
+    поэтому форма не сохраняется во временные файлы целиком. Если тело читал не обработчик,
+    а другое middleware (например, идемпотентности), исключение доходит сюда и ответ 413
+    отправляется здесь же
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int) -> None:
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if not headers.get("content-type", "").startswith("multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+        content_length = headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_size:
+            await self.reject(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def receive_limited() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    raise UploadTooLarge()
+            return message
+
+        async def send_tracked(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_tracked)
+        except UploadTooLarge:
+            if response_started:
+                raise
+            await self.reject(scope, receive, send)
+
+    @staticmethod
+    async def reject(scope: Scope, receive: Receive, send: Send) -> None:
+        response = responses.FastJSONResponse({"detail": DETAIL}, status_code=413, headers={"connection": "close"})
+        await response(scope, receive, send)
@@ -0,0 +1,92 @@
+"""
+Сравнивает прежний и быстрый пути выдачи списка задач на 1k/10k/100k строк.
+
+Прежний путь: задачи загружаются ORM-объектами, каждая проверяется pydantic-моделью Task,
+ответ кодируется стандартным JSON-кодировщиком FastAPI (jsonable_encoder + JSONResponse).
+Быстрый путь: выбираются только столбцы схемы Task (crud_tasks.get_tasks), строки кодируются
+без проверки моделями через orjson (responses.FastJSONResponse).
+
+Запуск из корня сервиса: python -m benchmarks.bench_list_serialization --dsn postgresql+asyncpg://...
+[--rows 1000 10000 100000] [--repeat 5]
+
+Таблицы создаются и заполняются во временной схеме, которая удаляется после замеров
+"""
+import argparse
+import asyncio
+import json
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database import models
+from app import crud_tasks, responses, schemas
+from .database import measure, seed, temporary_schema
+
+PROJECT_ID = 1
+
+
+def seed_statements(rows: int) -> tuple:
+    return (
+        f"""
+        INSERT INTO tasks (name, description, project_id, creator_id, executor_id, create_date, completion_date)
+        SELECT 'задача ' || i,
+               'описание задачи номер ' || i,
+               {PROJECT_ID},
+               md5('creator')::uuid,
+               md5((i % 100)::text)::uuid,
+               now() - i * interval '1 second',
+               CASE WHEN i % 3 = 0 THEN NULL ELSE now() + i * interval '1 hour' END
+        FROM generate_series(1, {rows}) AS i
+        """,
+    )
+
+
+async def orm_path(session_maker, rows: int) -> bytes:
+    async with session_maker() as db:
+        result = await db.execute(
+            select(models.Task)
+            .filter(models.Task.project_id == PROJECT_ID, models.Task.parent_task_id.is_(None))
+            .order_by(models.Task.create_date, models.Task.id)
+            .limit(rows)
+        )
+        tasks = [schemas.Task.model_validate(task, from_attributes=True) for task in result.scalars().all()]
+    return JSONResponse(jsonable_encoder(tasks)).body
+
+
+async def fast_path(session_maker, rows: int) -> bytes:
+    async with session_maker() as db:
+        tasks = await crud_tasks.get_tasks(db, project_id=PROJECT_ID, parent_task_id=None, limit=rows)
+    return responses.FastJSONResponse([dict(task) for task in tasks]).body
+
+
+async def run(dsn: str, sizes: list, repeat: int) -> None:
+    async with temporary_schema(dsn) as engine:
+        await seed(engine, *seed_statements(max(sizes)))
+        session_maker = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+        print(f"{'строк':>8} {'прежний, мс':>12} {'быстрый, мс':>12} {'ускорение':>10}")
+        for rows in sizes:
+            orm_body = await orm_path(session_maker, rows)
+            fast_body = await fast_path(session_maker, rows)
+            if json.loads(orm_body) != json.loads(fast_body):
+                raise RuntimeError(f"Ответы путей различаются на {rows} строках")
+
+            orm_time = await measure(lambda: orm_path(session_maker, rows), repeat)
+            fast_time = await measure(lambda: fast_path(session_maker, rows), repeat)
+            print(f"{rows:>8} {orm_time:>12.1f} {fast_time:>12.1f} {orm_time / fast_time:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сериализации списка задач")
+    parser.add_argument("--dsn", required=True, help="строка подключения postgresql+asyncpg://")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.dsn, args.rows, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Сравнивает загрузку дерева подзадач одним рекурсивным запросом (GET /tasks/{task_id}/tree,
+crud_tasks.get_task_tree) с обходом по уровням, которым клиент собирал дерево раньше: по запросу
+списка GET /tasks?project_id=..&parent_task_id=.. на каждый узел, страницами по --page-size задач.
+Каждый запрос списка выполняется в своей сессии, как отдельный HTTP-запрос; время HTTP-обмена
+в замер не входит, поэтому реальный выигрыш для клиента больше.
+
+Запуск из корня сервиса: python -m benchmarks.bench_task_tree --dsn postgresql+asyncpg://...
+[--nodes 10000] [--fanout 10] [--noise 100000] [--repeat 5]
+
+Дерево строится полным --fanout-арным деревом из --nodes задач, в других проектах создается
+--noise задач, чтобы запросы читали индексы заполненной таблицы. Данные создаются во временной
+схеме, которая удаляется после замеров
+"""
+import argparse
+import asyncio
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import crud_tasks
+from .database import measure, seed, temporary_schema
+
+PROJECT_ID = 1
+ROOT_ID = 1
+
+
+def seed_statements(nodes: int, fanout: int, noise: int) -> tuple:
+    # Задача i (начиная со второй) - потомок задачи (i - 2) / fanout + 1
+    return (
+        f"""
+        INSERT INTO tasks (id, name, project_id, parent_task_id, creator_id, create_date)
+        SELECT i,
+               'задача ' || i,
+               {PROJECT_ID},
+               CASE WHEN i = {ROOT_ID} THEN NULL ELSE (i - 2) / {fanout} + 1 END,
+               md5('creator')::uuid,
+               now() - i * interval '1 second'
+        FROM generate_series(1, {nodes}) AS i
+        """,
+        f"""
+        INSERT INTO tasks (id, name, project_id, parent_task_id, creator_id, create_date)
+        SELECT i,
+               'задача ' || i,
+               {PROJECT_ID} + 1 + (i - 1) / 10 % 1000,
+               CASE WHEN i % 10 = 1 THEN NULL ELSE i - (i - 1) % 10 END,
+               md5('creator')::uuid,
+               now() - i * interval '1 second'
+        FROM generate_series({nodes} + 1, {nodes} + {noise}) AS i
+        """,
+        "SELECT setval(pg_get_serial_sequence('tasks', 'id'), (SELECT max(id) FROM tasks))",
+    )
+
+
+async def load_tree(session_maker) -> int:
+    async with session_maker() as db:
+        return len(await crud_tasks.get_task_tree(db, ROOT_ID, max_depth=None))
+
+
+async def walk_levels(session_maker, page_size: int) -> tuple:
+    """
+    Обходит дерево по уровням запросами списка и возвращает количество задач и запросов
+    """
+    async with session_maker() as db:
+        root = await crud_tasks.get_task(db, ROOT_ID)
+    found, requests = 1, 1
+    level = [root.id]
+    while level:
+        next_level = []
+        for parent_task_id in level:
+            after = None
+            while True:
+                async with session_maker() as db:
+                    tasks = await crud_tasks.get_tasks(
+                        db, project_id=PROJECT_ID, parent_task_id=parent_task_id, limit=page_size + 1, after=after
+                    )
+                requests += 1
+                next_level.extend(task["id"] for task in tasks[:page_size])
+                if len(tasks) <= page_size:
+                    break
+                after = (tasks[page_size - 1]["create_date"], tasks[page_size - 1]["id"])
+        found += len(next_level)
+        level = next_level
+    return found, requests
+
+
+async def run(nodes: int, fanout: int, noise: int, page_size: int, repeat: int, dsn: str) -> None:
+    async with temporary_schema(dsn) as engine:
+        await seed(engine, *seed_statements(nodes, fanout, noise))
+        session_maker = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+        tree_size = await load_tree(session_maker)
+        walked, requests = await walk_levels(session_maker, page_size)
+        if tree_size != nodes or walked != nodes:
+            raise RuntimeError(f"Найдено задач: рекурсивным запросом {tree_size}, обходом {walked}, ожидалось {nodes}")
+
+        tree_time = await measure(lambda: load_tree(session_maker), repeat)
+        walk_time = await measure(lambda: walk_levels(session_maker, page_size), repeat)
+        print(f"Дерево из {nodes} задач (по {fanout} подзадач), еще {noise} задач в других проектах")
+        print(f"Рекурсивный запрос: {tree_time:.1f} мс, 1 запрос")
+        print(f"Обход по уровням:   {walk_time:.1f} мс, {requests} запросов")
+        print(f"Ускорение: {walk_time / tree_time:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузки дерева подзадач")
+    parser.add_argument("--dsn", required=True, help="строка подключения postgresql+asyncpg://")
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--noise", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.nodes, args.fanout, args.noise, args.page_size, args.repeat, args.dsn))
+
+
+if __name__ == "__main__":
+    main()
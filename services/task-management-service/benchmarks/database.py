@@ -0,0 +1,60 @@
+"""
+Общие функции бенчмарков: временная схема БД с таблицами сервиса и замер времени
+"""
+import statistics
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.database import DB_INITIALIZER
+
+
+@asynccontextmanager
+async def temporary_schema(dsn: str) -> AsyncIterator[AsyncEngine]:
+    """
+    Создает отдельную схему с таблицами сервиса и возвращает движок, соединения которого работают
+    в этой схеме. После выхода схема удаляется вместе с данными
+    """
+    schema = f"bench_{uuid.uuid4().hex}"
+    admin_engine = create_async_engine(dsn)
+    async with admin_engine.begin() as conn:
+        await conn.execute(text(f'CREATE SCHEMA "{schema}"'))
+    engine = create_async_engine(dsn, connect_args={"server_settings": {"search_path": schema}})
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(DB_INITIALIZER.create_schema)
+        yield engine
+    finally:
+        await engine.dispose()
+        async with admin_engine.begin() as conn:
+            await conn.execute(text(f'DROP SCHEMA "{schema}" CASCADE'))
+        await admin_engine.dispose()
+
+
+async def seed(engine: AsyncEngine, *statements: str) -> None:
+    """
+    Выполняет запросы заполнения одной транзакцией и обновляет статистику планировщика
+    """
+    async with engine.begin() as conn:
+        for statement in statements:
+            await conn.execute(text(statement))
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("ANALYZE"))
+
+
+async def measure(func: Callable[[], Awaitable], repeat: int) -> float:
+    """
+    Выполняет func один раз для прогрева, затем repeat раз и возвращает медианное время в миллисекундах
+    """
+    await func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
@@ -0,0 +1,128 @@
+"""
+Нагрузочный тест запущенного сервиса задач: --clients клиентов в течение --duration секунд
+без пауз выполняют GET-запросы и считают выполненные запросы в секунду, ошибки и задержки.
+
+Запуск из корня сервиса: python -m benchmarks.load_test --url http://127.0.0.1:5000
+[--clients 500] [--duration 30] [--processes 4] [--seed-tasks 1000] [--path /tasks/{task_id} ...]
+
+Перед замером создается --seed-tasks задач в отдельном проекте, пути запросов могут ссылаться
+на них через {task_id} (случайная задача) и {project_id}. Клиенты делятся между --processes
+процессами, чтобы генератор нагрузки сам не упирался в одно ядро; запускать его лучше на другой
+машине или на ядрах, не занятых сервисом.
+
+Для сравнения до и после перехода на асинхронный доступ к БД тест запускается с одинаковыми
+параметрами против сервиса, запущенного на прежней версии (синхронный движок, def-обработчики)
+и на текущей, с одинаковым числом воркеров uvicorn и одной и той же БД
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import statistics
+import time
+import uuid
+from typing import List
+
+import httpx
+
+DEFAULT_PATHS = [
+    "/tasks/{task_id}",
+    "/tasks?project_id={project_id}&limit=20",
+    "/comments?task_id={task_id}",
+]
+
+
+def seed_tasks(url: str, count: int) -> tuple:
+    """
+    Создает задачи в новом проекте и возвращает идентификатор проекта и задач
+    """
+    project_id = random.randint(10 ** 8, 2 * 10 ** 8)
+    creator_id = str(uuid.uuid4())
+    task_ids = []
+    with httpx.Client(base_url=url, timeout=30) as client:
+        for number in range(count):
+            task = {"name": f"задача {number}", "project_id": project_id, "creator_id": creator_id}
+            response = client.post("/tasks", data={"task": json.dumps(task)})
+            response.raise_for_status()
+            task_ids.append(response.json()["id"])
+    return project_id, task_ids
+
+
+async def client_loop(client: httpx.AsyncClient,
+                      paths: List[str],
+                      project_id: int,
+                      task_ids: List[int],
+                      deadline: float,
+                      latencies: List[float],
+                      errors: List[str]) -> None:
+    while time.perf_counter() < deadline:
+        path = random.choice(paths).format(project_id=project_id, task_id=random.choice(task_ids))
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        if response.status_code >= 400:
+            errors.append(str(response.status_code))
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_clients(url: str, clients: int, duration: float, paths: List[str],
+                      project_id: int, task_ids: List[int]) -> tuple:
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            client_loop(client, paths, project_id, task_ids, deadline, latencies, errors) for _ in range(clients)
+        ))
+    return latencies, errors
+
+
+def run_process(args: tuple) -> tuple:
+    return asyncio.run(run_clients(*args))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервиса задач")
+    parser.add_argument("--url", required=True, help="адрес сервиса, например http://127.0.0.1:5000")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed-tasks", type=int, default=1000)
+    parser.add_argument("--path", action="append", dest="paths",
+                        help="путь запроса с подстановками {task_id} и {project_id}, можно указать несколько раз")
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+
+    project_id, task_ids = seed_tasks(args.url, args.seed_tasks)
+    clients = [args.clients // args.processes + (index < args.clients % args.processes)
+               for index in range(args.processes)]
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(run_process, [
+            (args.url, count, args.duration, paths, project_id, task_ids) for count in clients
+        ])
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for process_latencies, _ in results for latency in process_latencies)
+    errors = [error for _, process_errors in results for error in process_errors]
+    print(f"Клиентов: {args.clients}, длительность: {elapsed:.1f} с, пути: {', '.join(paths)}")
+    print(f"Успешных запросов: {len(latencies)}, в секунду: {len(latencies) / elapsed:.1f}")
+    if latencies:
+        print(f"Задержка, мс: медиана {statistics.median(latencies) * 1000:.1f}, "
+              f"p95 {percentile(latencies, 0.95):.1f}, p99 {percentile(latencies, 0.99):.1f}")
+    if errors:
+        counts = {error: errors.count(error) for error in set(errors)}
+        print(f"Ошибок: {len(errors)} ({', '.join(f'{error}: {count}' for error, count in sorted(counts.items()))})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import pytest
+
+from app import compact_comments, crud_comments
+
+Row = namedtuple("Row", "id task_id user_id create_date data")
+
+USER_ID = uuid.uuid4()
+EXECUTOR_ID = uuid.uuid4()
+CREATE_DATE = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+COMPLETION_DATE = datetime(2024, 2, 1, tzinfo=timezone.utc)
+
+UPDATE_DICT = {
+    "name": ("old", "new"),
+    "description": ("old description", "new description"),
+    "executor_id": (None, EXECUTOR_ID),
+    "completion_date": (COMPLETION_DATE, None),
+}
+
+
+def legacy_comments(update_dict: dict) -> list:
+    return [crud_comments.build_system_comment(1, USER_ID, CREATE_DATE, field, value)
+            for field, value in update_dict.items()]
+
+
+def comparable(comments: list) -> list:
+    return [(comment["type_id"], comment["data"]) for comment in comments]
+
+
+def test_expand_comment_reproduces_legacy_comments():
+    change_set = crud_comments.build_change_set(1, USER_ID, CREATE_DATE, UPDATE_DICT)
+    assert change_set["type_id"] == crud_comments.CHANGE_SET_TYPE_ID
+    assert change_set["data"]["description"] == [None, None]
+
+    expanded = crud_comments.expand_comment(change_set)
+    assert comparable(expanded) == comparable(legacy_comments(UPDATE_DICT))
+    assert all(comment["task_id"] == 1 and comment["user_id"] == USER_ID for comment in expanded)
+
+
+def test_expand_comment_ids_are_stable():
+    change_set = crud_comments.build_change_set(1, USER_ID, CREATE_DATE, {"name": ("a", "b"), "executor_id": (None, None)})
+    ids = [comment["id"] for comment in crud_comments.expand_comment(change_set)]
+    assert ids == [comment["id"] for comment in crud_comments.expand_comment(change_set)]
+    assert len(set(ids)) == 2
+
+
+def test_expand_comment_keeps_other_comments():
+    comment = {"id": uuid.uuid4(), "type_id": 4, "data": {"text": "hello"}}
+    assert crud_comments.expand_comment(comment) == [comment]
+
+
+def test_build_change_sets_groups_by_update():
+    other_date = datetime(2024, 1, 3, tzinfo=timezone.utc)
+    rows = [
+        Row(uuid.uuid4(), 1, USER_ID, CREATE_DATE, comment["data"]) for comment in legacy_comments(UPDATE_DICT)
+    ] + [
+        Row(uuid.uuid4(), 1, USER_ID, other_date, comment["data"]) for comment in legacy_comments({"name": ("new", "x")})
+    ]
+    change_sets = compact_comments.build_change_sets(rows)
+    assert len(change_sets) == 2
+
+    expanded = [comment for change_set in change_sets for comment in crud_comments.expand_comment(change_set)]
+    assert [comment["data"] for comment in expanded] == [row.data for row in rows]
+    assert [comment["create_date"] for comment in expanded] == [row.create_date for row in rows]
+
+
+def test_build_change_sets_splits_repeated_field():
+    rows = [
+        Row(uuid.uuid4(), 1, USER_ID, CREATE_DATE, comment["data"])
+        for comment in legacy_comments({"name": ("a", "b")}) + legacy_comments({"name": ("b", "c")})
+    ]
+    change_sets = compact_comments.build_change_sets(rows)
+    assert [change_set["data"]["name"] for change_set in change_sets] == [["a", "b"], ["b", "c"]]
+
+
+def test_legacy_change_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        compact_comments.legacy_change({"text": "hello"})
@@ -0,0 +1,63 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import crud_tasks
+from app.schemas import TaskBatchItem
+
+CREATOR_ID = uuid.uuid4()
+
+
+def batch_item(temp_id=None, parent_temp_id=None, project_id=1, parent_task_id=None):
+    return TaskBatchItem(
+        name="task",
+        project_id=project_id,
+        creator_id=CREATOR_ID,
+        temp_id=temp_id,
+        parent_temp_id=parent_temp_id,
+        parent_task_id=parent_task_id
+    )
+
+
+def test_resolve_batch_parents_returns_positions_of_parents():
+    tasks = [
+        batch_item(temp_id="child", parent_temp_id="root"),
+        batch_item(temp_id="root"),
+        batch_item(parent_temp_id="child"),
+        batch_item(parent_task_id=10)
+    ]
+    assert crud_tasks.resolve_batch_parents(tasks) == [1, None, 0, None]
+
+
+@pytest.mark.parametrize("tasks, message", [
+    ([batch_item(temp_id="a"), batch_item(temp_id="a")], "Повторяющийся temp_id"),
+    ([batch_item(parent_temp_id="missing")], "не найдена"),
+    ([batch_item(temp_id="a"), batch_item(parent_temp_id="a", project_id=2)], "другому проекту"),
+    ([batch_item(temp_id="a"), batch_item(parent_temp_id="a", parent_task_id=5)], "одновременно"),
+    ([batch_item(temp_id="a", parent_temp_id="b"), batch_item(temp_id="b", parent_temp_id="a")], "Цикл"),
+    ([batch_item(temp_id="a", parent_temp_id="a")], "Цикл"),
+])
+def test_resolve_batch_parents_rejects_invalid_batches(tasks, message):
+    with pytest.raises(ValueError, match=message):
+        crud_tasks.resolve_batch_parents(tasks)
+
+
+def test_resolve_batch_parents_handles_deep_chains():
+    tasks = [batch_item(temp_id="0")]
+    tasks += [batch_item(temp_id=str(i), parent_temp_id=str(i - 1)) for i in range(1, 5000)]
+    parents = crud_tasks.resolve_batch_parents(tasks)
+    assert parents == [None] + list(range(4999))
+
+
+def test_normalize_update_values_makes_dates_comparable_with_stored_values():
+    stored = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    values = crud_tasks.normalize_update_values({
+        "completion_date": datetime(2024, 1, 1),
+        "name": "name"
+    })
+    assert values == {"completion_date": stored, "name": "name"}
+    assert values["completion_date"].tzinfo is timezone.utc
+
+    offset = datetime(2024, 1, 1, 3, tzinfo=timezone(timedelta(hours=3)))
+    assert crud_tasks.normalize_update_values({"completion_date": offset})["completion_date"] == stored
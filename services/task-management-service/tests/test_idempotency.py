@@ -0,0 +1,62 @@
+import tempfile
+
+import pytest
+
+from app import idempotency
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    return "asyncio"
+
+
+def make_receive(chunks: list):
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    return receive
+
+
+def multipart_scope(boundary: str) -> dict:
+    return {"type": "http", "headers": [(b"content-type", f"multipart/form-data; boundary={boundary}".encode())]}
+
+
+def multipart(boundary: str, data: bytes) -> bytes:
+    return (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.bin"\r\n\r\n'
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+
+
+async def read_and_replay(scope: dict, chunks: list) -> tuple:
+    with tempfile.SpooledTemporaryFile(max_size=idempotency.SPOOL_MAX_SIZE) as spool:
+        fingerprint = await idempotency.read_body(scope, make_receive(chunks), spool)
+        receive = idempotency.replay_body(spool, make_receive([]))
+        replayed = []
+        while True:
+            message = await receive()
+            replayed.append(message["body"])
+            if not message["more_body"]:
+                break
+    return fingerprint, b"".join(replayed)
+
+
+async def test_large_body_is_replayed_from_disk():
+    body = multipart("first", bytes(range(256)) * (idempotency.SPOOL_MAX_SIZE // 128))
+    chunks = [body[i:i + 100000] for i in range(0, len(body), 100000)]
+    fingerprint, replayed = await read_and_replay(multipart_scope("first"), chunks)
+    assert replayed == body
+    assert fingerprint is not None
+
+
+async def test_fingerprint_ignores_multipart_boundary():
+    data = b"x" * 1000
+    first, _ = await read_and_replay(multipart_scope("first"), [multipart("first", data)])
+    second, _ = await read_and_replay(multipart_scope("second-boundary"), [multipart("second-boundary", data)])
+    other, _ = await read_and_replay(multipart_scope("first"), [multipart("first", data + b"y")])
+    assert first == second
+    assert first != other
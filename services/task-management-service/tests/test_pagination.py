@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app import pagination
+
+
+def test_cursor_round_trip():
+    key_date = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    cursor = pagination.encode_cursor(key_date, 42)
+    assert "=" not in cursor
+    assert pagination.decode_cursor(cursor) == (key_date, 42)
+
+
+def test_null_date_cursor_is_accepted_only_when_allowed():
+    cursor = pagination.encode_cursor(None, 7)
+    assert pagination.decode_cursor(cursor, nullable_date=True) == (None, 7)
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "WzFd", "WyJ4IiwxXQ", "WyIyMDI0LTAxLTAxIiwieCJd"])
+def test_decode_cursor_rejects_malformed_cursors(cursor):
+    with pytest.raises(ValueError, match="Некорректный курсор"):
+        pagination.decode_cursor(cursor)
+
+
+def test_search_cursor_round_trip():
+    cursor = pagination.encode_search_cursor(0.25, "comment", "8d0c5c1e-6f9c-4b8e-9d55-1f2a3b4c5d6e")
+    assert pagination.decode_search_cursor(cursor) == (0.25, "comment", "8d0c5c1e-6f9c-4b8e-9d55-1f2a3b4c5d6e")
+
+
+def test_decode_search_cursor_rejects_malformed_cursors():
+    with pytest.raises(ValueError):
+        pagination.decode_search_cursor(pagination.encode_cursor(None, 1))
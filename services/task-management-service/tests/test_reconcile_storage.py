@@ -0,0 +1,36 @@
+import os
+from collections import Counter
+
+import pytest
+
+from app import reconcile_storage
+
+
+@pytest.fixture
+def orphan(tmp_path):
+    file_path = os.path.join(str(tmp_path), "ab", "cd", "abcd.pdf")
+    os.makedirs(os.path.dirname(file_path))
+    with open(file_path, "wb") as f:
+        f.write(b"x" * 10)
+    return file_path
+
+
+def test_deleted_orphan_is_reported_as_deleted_bytes(tmp_path, orphan):
+    report = Counter()
+    reconcile_storage.handle_orphan(str(tmp_path), orphan, 0, "delete", report)
+    assert not os.path.exists(orphan)
+    assert report == Counter(orphans=1, orphan_bytes=10, deleted_bytes=10)
+
+
+def test_quarantined_orphan_is_not_reported_as_deleted(tmp_path, orphan):
+    report = Counter()
+    reconcile_storage.handle_orphan(str(tmp_path), orphan, 0, "quarantine", report)
+    assert os.path.isfile(os.path.join(str(tmp_path), reconcile_storage.QUARANTINE_DIR, "ab", "cd", "abcd.pdf"))
+    assert report == Counter(orphans=1, orphan_bytes=10, quarantined_bytes=10)
+
+
+def test_recent_orphan_is_skipped(tmp_path, orphan):
+    report = Counter()
+    reconcile_storage.handle_orphan(str(tmp_path), orphan, 3600, "delete", report)
+    assert os.path.exists(orphan)
+    assert report == Counter(recent_skipped=1)
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+import pytest
+from starlette.requests import Request
+
+from app import responses
+
+LAST_MODIFIED = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+LAST_MODIFIED_HTTP = "Tue, 02 Jan 2024 03:04:05 GMT"
+
+
+def make_request(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    })
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    ("bytes = 0-0", (0, 0)),
+])
+def test_parse_range_returns_inclusive_bounds(header, expected):
+    assert responses.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-10",
+    "bytes=0-10,20-30",
+    "bytes=-",
+    "bytes=a-b",
+    "bytes=10-5",
+])
+def test_parse_range_ignores_unsupported_or_invalid_ranges(header):
+    assert responses.parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=-10", 0),
+])
+def test_parse_range_rejects_unsatisfiable_ranges(header, size):
+    with pytest.raises(ValueError):
+        responses.parse_range(header, size)
+
+
+def test_if_range_matches_strong_etag_only():
+    assert responses.if_range_matches(make_request(), '"abc"', LAST_MODIFIED)
+    assert responses.if_range_matches(make_request(if_range='"abc"'), '"abc"', LAST_MODIFIED)
+    assert not responses.if_range_matches(make_request(if_range='"abd"'), '"abc"', LAST_MODIFIED)
+    assert not responses.if_range_matches(make_request(if_range='W/"abc"'), 'W/"abc"', LAST_MODIFIED)
+
+
+def test_if_range_matches_exact_date():
+    assert responses.if_range_matches(make_request(if_range=LAST_MODIFIED_HTTP), '"abc"', LAST_MODIFIED)
+    assert not responses.if_range_matches(
+        make_request(if_range="Tue, 02 Jan 2024 03:04:04 GMT"), '"abc"', LAST_MODIFIED
+    )
+    assert not responses.if_range_matches(make_request(if_range=LAST_MODIFIED_HTTP), '"abc"', None)
+
+
+def test_is_not_modified():
+    etag = responses.collection_etag(3, LAST_MODIFIED)
+    assert responses.is_not_modified(make_request(if_none_match=etag), etag, None)
+    assert responses.is_not_modified(make_request(if_none_match=f'"x", {etag.removeprefix("W/")}'), etag, None)
+    assert responses.is_not_modified(make_request(if_none_match="*"), etag, None)
+    assert not responses.is_not_modified(make_request(if_none_match='"x"'), etag, LAST_MODIFIED)
+    assert responses.is_not_modified(make_request(if_modified_since=LAST_MODIFIED_HTTP), etag, LAST_MODIFIED)
+    assert not responses.is_not_modified(
+        make_request(if_modified_since="Tue, 02 Jan 2024 03:04:04 GMT"), etag, LAST_MODIFIED
+    )
+
+
+def test_parse_if_match():
+    assert responses.parse_if_match(make_request()) is None
+    assert responses.parse_if_match(make_request(if_match="*")) is None
+    assert responses.parse_if_match(make_request(if_match='"3", "5"')) == [3, 5]
+    assert responses.parse_if_match(make_request(if_match='W/"3", "abc"')) == []
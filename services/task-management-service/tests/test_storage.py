@@ -0,0 +1,30 @@
+import os
+
+from app import storage
+
+
+def create_files(root, paths):
+    for path in paths:
+        full_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(b"x")
+
+
+def test_walk_sorted_orders_paths_like_collate_c(tmp_path):
+    paths = ["a.pdf", "a/b.pdf", "a-b.pdf", "ab/cd/x.pdf", "a0.pdf", "B.pdf", "ab.pdf", ".tmp/upload"]
+    create_files(tmp_path, paths)
+    walked = list(storage.walk_sorted(str(tmp_path), []))
+    expected = sorted(os.path.join(str(tmp_path), path) for path in paths)
+    assert walked == expected
+    assert walked == sorted(walked, key=lambda path: path.encode())
+
+
+def test_walk_sorted_skips_excluded_directories(tmp_path):
+    create_files(tmp_path, ["ab/cd/x.pdf", ".quarantine/ab/cd/y.pdf"])
+    walked = list(storage.walk_sorted(str(tmp_path), [os.path.join(str(tmp_path), ".quarantine")]))
+    assert walked == [os.path.join(str(tmp_path), "ab/cd/x.pdf")]
+
+
+def test_sharded_path_uses_two_levels_of_hash_prefix():
+    assert storage.sharded_path("storage", "abcdef.pdf") == os.path.join("storage", "ab", "cd", "abcdef.pdf")
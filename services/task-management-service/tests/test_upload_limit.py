@@ -0,0 +1,81 @@
+import json
+
+import pytest
+from fastapi import FastAPI, UploadFile
+
+from app import idempotency, upload_limit
+
+pytestmark = pytest.mark.anyio
+
+MAX_SIZE = 200
+BOUNDARY = "boundary"
+
+
+@pytest.fixture(scope="module")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="module")
+def app():
+    app = FastAPI()
+
+    @app.post("/documents")
+    async def create_document(file: UploadFile):
+        return {"size": file.size}
+
+    # Порядок middleware тот же, что в app.app: ограничение размера снаружи идемпотентности
+    app.add_middleware(idempotency.IdempotencyMiddleware, paths={"/documents"}, wait_timeout=1)
+    app.add_middleware(upload_limit.UploadSizeLimitMiddleware, max_size=MAX_SIZE)
+    return app
+
+
+def multipart(size: int) -> bytes:
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="a.txt"\r\n'
+        f"Content-Type: text/plain\r\n\r\n"
+    ).encode() + b"x" * size + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def post_chunked(app, body: bytes, headers: dict) -> tuple:
+    """
+    Отправляет тело блоками по 64 байта без Content-Length и возвращает статус и JSON ответа
+    """
+    messages = [{"type": "http.request", "body": body[i:i + 64], "more_body": True} for i in range(0, len(body), 64)]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+    headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}", **headers}
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/documents",
+        "raw_path": b"/documents",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(name.encode(), value.encode()) for name, value in headers.items()],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]["status"], json.loads(b"".join(message.get("body", b"") for message in sent[1:]))
+
+
+async def test_small_chunked_upload_passes(app):
+    assert await post_chunked(app, multipart(10), {}) == (200, {"size": 10})
+
+
+@pytest.mark.parametrize("headers", [{}, {"idempotency-key": "k1"}])
+async def test_chunked_upload_over_limit_is_rejected_with_413(app, headers):
+    status, body = await post_chunked(app, multipart(MAX_SIZE), headers)
+    assert status == 413
+    assert body == {"detail": upload_limit.DETAIL}